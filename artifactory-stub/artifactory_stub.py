@@ -0,0 +1,293 @@
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+from urllib.parse import parse_qs, urlparse
+
+
+@dataclass
+class StubConfig:
+    latency_ms: float = 0
+    error_rate: float = 0
+    users: int = 10
+    properties: int = 10
+    vulnerabilities: int = 10
+    max_page_size: int = 100
+    scan_delay_ms: float = 0
+    # Tag -> tag it is an alias of, e.g. {"latest": "1.0.0"}. Aliases resolve to the same manifest digest
+    tag_aliases: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class StubState:
+    indexed: Dict[str, float] = field(default_factory=dict)
+    reports: Dict[int, dict] = field(default_factory=dict)
+    users: Dict[str, dict] = field(default_factory=dict)
+    properties: Dict[str, Dict[str, list]] = field(default_factory=dict)
+    requests: int = 0
+    errors: int = 0
+
+
+def create_users(count):
+    users = {}
+    realms = ["internal", "internal", "internal", "ldap", "saml"]
+    for index in range(count):
+        name = f"sa_user-{index}@example.com" if index % 10 == 0 else f"user-{index}@example.com"
+        users[name] = {"name": name, "email": name, "admin": index % 50 == 0, "realm": realms[index % len(realms)],
+                       "lastLoggedInMillis": 0 if index % 3 == 0 else 1600000000000 + index,
+                       "internalPasswordDisabled": index % 7 == 0, "profileUpdatable": True, "groups": ["readers"]}
+    return users
+
+
+def create_vulnerability_rows(count):
+    return [{"issue_id": f"XRAY-{index}", "summary": f"Vulnerability {index}", "severity": "Critical",
+             "vulnerable_component": f"deb://debian:buster:lib{index}:1.0.{index}",
+             "cves": [{"cve": f"CVE-2021-{10000 + index}", "cvss_v3_score": 9.8}]}
+            for index in range(count)]
+
+
+class ArtifactoryStub:
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.state = StubState(users=create_users(config.users))
+        self._lock = threading.Lock()
+        self._report_ids = itertools.count(1)
+        self._vulnerability_rows = create_vulnerability_rows(config.vulnerabilities)
+        self._routes = [
+            ("GET", r"/artifactory/api/system/ping", self.ping),
+            ("GET", r"/stub/stats", self.stats),
+            ("POST", r"/xray/api/v1/scanArtifact", self.scan_artifact),
+            ("GET", r"/ui/api/v1/ui/artifactxray", self.artifact_xray_status),
+            ("POST", r"/xray/api/v1/summary/artifact", self.artifact_summary),
+            ("POST", r"/xray/api/v1/reports", self.list_reports),
+            ("POST", r"/xray/api/v1/reports/vulnerabilities", self.create_report),
+            ("POST", r"/xray/api/v1/reports/vulnerabilities/(?P<report_id>\d+)", self.report_details),
+            ("GET", r"/xray/api/v1/reports/(?P<report_id>\d+)", self.report_status),
+            ("DELETE", r"/xray/api/v1/reports/(?P<report_id>\d+)", self.delete_report),
+            ("GET", r"/artifactory/api/security/users", self.get_users),
+            ("GET", r"/artifactory/api/security/users/(?P<name>[^/]+)", self.get_user),
+            ("POST", r"/artifactory/api/security/users/(?P<name>[^/]+)", self.update_user),
+            ("PATCH", r"/artifactory/api/metadata/(?P<path>.+)", self.update_properties),
+            ("DELETE", r"/artifactory/api/storage/(?P<path>.+)", self.delete_properties),
+            ("GET", r"/artifactory/api/storage/(?P<path>.+)/manifest.json", self.manifest_info),
+            ("POST", r"/artifactory/api/search/aql", self.search_items),
+            ("GET", r"/artifactory/(?P<path>(?!api/).+)", self.get_properties),
+        ]
+        self._routes = [(method, re.compile(pattern + "$"), handler) for method, pattern, handler in self._routes]
+
+    def handle(self, method, url, body):
+        with self._lock:
+            self.state.requests += 1
+        request = urlparse(url)
+        query = {key: values[0] for key, values in parse_qs(request.query, keep_blank_values=True).items()}
+        for route_method, pattern, handler in self._routes:
+            match = pattern.match(request.path)
+            if route_method == method and match:
+                if self.config.latency_ms:
+                    time.sleep(self.config.latency_ms / 1000)
+                if handler not in (self.ping, self.stats) and random.random() < self.config.error_rate:
+                    with self._lock:
+                        self.state.errors += 1
+                    return 500, {"errors": [{"message": "Injected error"}]}
+                with self._lock:
+                    return handler(query=query, body=body, **match.groupdict())
+        return 404, {"errors": [{"message": f"No route for {method} {request.path}"}]}
+
+    def ping(self, **kwargs):
+        return 200, "OK"
+
+    def stats(self, **kwargs):
+        return 200, {"requests": self.state.requests, "errors": self.state.errors}
+
+    def scan_artifact(self, body, **kwargs):
+        component_id = json.loads(body)["componentID"]
+        self.state.indexed[component_path(component_id)] = time.monotonic() + self.config.scan_delay_ms / 1000
+        return 200, {"info": "Scan of artifact is in progress"}
+
+    def artifact_xray_status(self, query, **kwargs):
+        status = "Indexed" if self.is_indexed(query.get("path", "")) else "Not indexed"
+        return 200, {"xrayIndexStatus": status, "repoKey": query.get("repoKey")}
+
+    def is_indexed(self, path):
+        # Scanned components are keyed by their path, any file below it is indexed
+        parts = path.split("/")
+        for depth in range(len(parts) - 1, 0, -1):
+            ready = self.state.indexed.get("/".join(parts[:depth]))
+            if ready is not None:
+                return ready <= time.monotonic()
+        return False
+
+    def artifact_summary(self, body, **kwargs):
+        artifacts, errors = [], []
+        for path in json.loads(body)["paths"]:
+            # <artifactory id>/<repo key>/<path>
+            if self.is_indexed(path.split("/", 2)[-1]):
+                artifacts.append({"general": {"path": path, "name": path.rsplit("/", 1)[-1]}, "issues": []})
+            else:
+                errors.append({"error": "Artifact doesn't exist or not indexed/cached in Xray", "identifier": path})
+        return 200, {"artifacts": artifacts, "errors": errors}
+
+    def create_report(self, body, **kwargs):
+        report_id = next(self._report_ids)
+        self.state.reports[report_id] = {"id": report_id, "name": json.loads(body)["name"], "status": "completed",
+                                         "num_of_processed_artifacts": 1, "total_artifacts": 1, "author": "stub",
+                                         "start_time": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}
+        return 200, {"report_id": report_id, "status": "pending"}
+
+    def list_reports(self, query, **kwargs):
+        page_size = int(query.get("num_of_rows", 10))
+        first_report = (int(query.get("page_num", 1)) - 1) * page_size
+        reports = list(self.state.reports.values())
+        return 200, {"total_reports": len(reports), "reports": reports[first_report:first_report + page_size]}
+
+    def report_status(self, report_id, **kwargs):
+        report = self.state.reports.get(int(report_id))
+        if not report:
+            return 404, {"error": f"Report {report_id} not found"}
+        return 200, report
+
+    def report_details(self, report_id, query, **kwargs):
+        if int(report_id) not in self.state.reports:
+            return 404, {"error": f"Report {report_id} not found"}
+        page_size = min(int(query.get("num_of_rows", 100)), self.config.max_page_size)
+        first_row = (int(query.get("page_num", 1)) - 1) * page_size
+        return 200, {"total_rows": len(self._vulnerability_rows),
+                     "rows": self._vulnerability_rows[first_row:first_row + page_size]}
+
+    def delete_report(self, report_id, **kwargs):
+        if not self.state.reports.pop(int(report_id), None):
+            return 404, {"error": f"Report {report_id} not found"}
+        return 200, {"info": "report deleted successfully"}
+
+    def manifest_digest(self, path):
+        image, _, tag = path.rpartition("/")
+        return hashlib.sha256(f"{image}/{self.config.tag_aliases.get(tag, tag)}".encode()).hexdigest()
+
+    def manifest_info(self, path, **kwargs):
+        return 200, {"repo": path.split("/", 1)[0], "path": f"/{path}/manifest.json",
+                     "checksums": {"sha256": self.manifest_digest(path)}}
+
+    def search_items(self, body, **kwargs):
+        # Only items.find({"repo": ..., "name": "manifest.json", "$or": [{"path": ...}, ...]}) is supported
+        query = body.decode()
+        criteria = json.loads(query[query.index("(") + 1:query.index(").include")])
+        results = [{"repo": criteria["repo"], "path": item["path"], "name": "manifest.json",
+                    "sha256": self.manifest_digest(f"{criteria['repo']}/{item['path']}")}
+                   for item in criteria.get("$or", [])]
+        return 200, {"results": results, "range": {"start_pos": 0, "end_pos": len(results), "total": len(results)}}
+
+    def get_users(self, **kwargs):
+        return 200, [{"name": user["name"], "realm": user["realm"],
+                      "uri": f"/artifactory/api/security/users/{user['name']}"} for user in self.state.users.values()]
+
+    def get_user(self, name, **kwargs):
+        if name not in self.state.users:
+            return 404, {"errors": [{"message": f"User {name} not found"}]}
+        return 200, self.state.users[name]
+
+    def update_user(self, name, body, **kwargs):
+        if name not in self.state.users:
+            return 404, {"errors": [{"message": f"User {name} not found"}]}
+        self.state.users[name].update(json.loads(body))
+        return 200, ""
+
+    def file_properties(self, path):
+        if path not in self.state.properties:
+            self.state.properties[path] = {f"{path.rsplit('/', 1)[-1]}.property-{index}": [f"value-{index}"]
+                                           for index in range(self.config.properties)}
+        return self.state.properties[path]
+
+    def get_properties(self, path, query, **kwargs):
+        if "properties" not in query:
+            return 404, {"errors": [{"message": f"Only properties of {path} are available"}]}
+        return 200, {"properties": self.file_properties(path), "uri": f"/artifactory/api/storage/{path}"}
+
+    def update_properties(self, path, body, **kwargs):
+        properties = self.file_properties(path)
+        for key, value in json.loads(body)["props"].items():
+            properties[key] = [value]
+        return 204, ""
+
+    def delete_properties(self, path, query, **kwargs):
+        properties = self.file_properties(path)
+        for key in query.get("properties", "").split(","):
+            properties.pop(key, None)
+        return 204, ""
+
+
+def component_path(component_id):
+    last_colon_idx = component_id.rfind(":")
+    type_index = component_id.find("//") + 2
+    return component_id[type_index:last_colon_idx] + "/" + component_id[last_colon_idx + 1:]
+
+
+def create_handler(stub):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def respond(self):
+            length = int(self.headers.get("content-length") or 0)
+            body = self.rfile.read(length) if length else b""
+            status, payload = stub.handle(self.command, self.path, body)
+            data = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("content-type", "text/plain" if isinstance(payload, str) else "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_PATCH = do_DELETE = respond
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_server(config: StubConfig, host="localhost", port=0):
+    stub = ArtifactoryStub(config)
+    server = ThreadingHTTPServer((host, port), create_handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="artifactory-stub", daemon=True).start()
+    return server, stub
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Local stand-in for the artifactory and xray endpoints used by '
+                                                 'the ci scripts')
+    parser.add_argument("--host", default="localhost", help="Host to listen on")
+    parser.add_argument("--port", type=int, default=8081, help="Port to listen on")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay added to every response")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with status 500")
+    parser.add_argument("--users", type=int, default=10, help="Number of users")
+    parser.add_argument("--properties", type=int, default=10, help="Number of properties of every file")
+    parser.add_argument("--vulnerabilities", type=int, default=10, help="Number of rows of every report")
+    parser.add_argument("--max-page-size", type=int, default=100, help="Maximum number of report rows per page")
+    parser.add_argument("--scan-delay-ms", type=float, default=0, help="Time until a scanned artifact is indexed")
+    parser.add_argument("--tag-alias", action="append", default=[],
+                        help="alias=tag, e.g. latest=1.0.0. Both tags resolve to the same manifest digest")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    stub_config = StubConfig(args.latency_ms, args.error_rate, args.users, args.properties, args.vulnerabilities,
+                             args.max_page_size, args.scan_delay_ms,
+                             dict(alias.split("=", 1) for alias in args.tag_alias))
+    stub_server = ThreadingHTTPServer((args.host, args.port), create_handler(ArtifactoryStub(stub_config)))
+    print(f"Serving artifactory stub on http://{args.host}:{stub_server.server_port}")
+    try:
+        stub_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,81 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from artifactory_stub import StubConfig, start_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+SCALES = [10, 1000, 10000]
+
+
+def scan_command(base_url, scale, work_dir):
+    # The scan only reads the first page of a report, so it is scaled by the number of components instead of the
+    # number of vulnerabilities per report
+    component_ids = [f"docker://bench/path/component-{index}:1.0.0" for index in range(scale)]
+    return [os.path.join(REPO_ROOT, "xray-scanning", "scan.py"), "--base-url", base_url, "--user", "bench",
+            "--token", "bench", *[arg for component_id in component_ids for arg in ("--component-id", component_id)],
+            "--repo-key", "bench", "--report-target-directory", work_dir]
+
+
+def users_command(base_url, scale, work_dir):
+    return [os.path.join(REPO_ROOT, "update_users", "update_users.py"), "--base-url", base_url, "--token", "bench"]
+
+
+def props_command(base_url, scale, work_dir):
+    return [os.path.join(REPO_ROOT, "copy-properties", "copy_properties.py"), "--base-url", base_url,
+            "--token", "bench", "--source-file-path", "bench/source.bin", "--target-file-path", "bench/target.bin",
+            "--properties-count", str(scale)]
+
+
+TOOLS = {
+    "scan": (scan_command, lambda scale: StubConfig()),
+    "users": (users_command, lambda scale: StubConfig(users=scale)),
+    "props": (props_command, lambda scale: StubConfig(properties=scale)),
+}
+
+
+def run_tool(tool, scale, latency_ms, error_rate):
+    command, create_config = TOOLS[tool]
+    config = create_config(scale)
+    config.latency_ms = latency_ms
+    config.error_rate = error_rate
+    server, stub = start_server(config)
+    base_url = f"http://localhost:{server.server_port}"
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            started = time.perf_counter()
+            process = subprocess.Popen([sys.executable, *command(base_url, scale, work_dir)], cwd=work_dir,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            _, status, usage = os.wait4(process.pid, 0)
+            wall_seconds = time.perf_counter() - started
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return {"tool": tool, "scale": scale, "exit_code": os.waitstatus_to_exitcode(status),
+            "requests": stub.state.requests, "injected_errors": stub.state.errors,
+            "wall_seconds": round(wall_seconds, 3),
+            "requests_per_second": round(stub.state.requests / wall_seconds, 1),
+            "peak_rss_mb": round(usage.ru_maxrss / 1024, 1)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the artifactory tools against the local artifactory stub')
+    parser.add_argument("--tool", action="append", choices=sorted(TOOLS),
+                        help="Tool to benchmark, can be repeated. Defaults to all tools")
+    parser.add_argument("--scale", action="append", type=int,
+                        help=f"Number of entities (users, properties or scanned components), can be repeated. "
+                             f"Defaults to {SCALES}")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Latency added to every stub response")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of stub requests failing with 500")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    for tool_name in args.tool or sorted(TOOLS):
+        for entity_count in args.scale or SCALES:
+            print(json.dumps(run_tool(tool_name, entity_count, args.latency_ms, args.error_rate)), flush=True)
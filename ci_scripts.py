@@ -0,0 +1,108 @@
+import argparse
+import importlib
+import logging
+import os
+import shlex
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.realpath(__file__))
+
+# Subcommand -> (tool folder, module). Modules are only imported when their subcommand runs.
+TOOLS = {
+    "scan": ("xray-scanning", "scan"),
+    "sweep-reports": ("xray-scanning", "sweep_reports"),
+    "report-archive": ("xray-scanning", "report_archive"),
+    "users": ("update_users", "update_users"),
+    "props": ("copy-properties", "copy_properties"),
+    "render": ("helm-helpers", "helm_helpers"),
+    "release": ("push_release", "push_release"),
+    "bump-dep": ("update-helm-dependency", "update_helm_dependency"),
+    "policies": ("get-policy-files", "get_policy_files"),
+    "tail": ("websocket-client", "websocket_client"),
+}
+
+
+def load_tool(command):
+    folder, module = TOOLS[command]
+    tool_path = os.path.join(REPO_ROOT, folder)
+    if tool_path not in sys.path:
+        sys.path.insert(0, tool_path)
+    return importlib.import_module(module)
+
+
+def run_step(command, argv):
+    if command not in TOOLS:
+        logging.error(f"Unknown command {command}, expected one of {', '.join(TOOLS)}")
+        return 2
+    try:
+        load_tool(command).main(argv)
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except Exception:
+        # A failing step must not end the batch, later steps run depending on --keep-going
+        logging.exception(f"Step {command} failed")
+        return 1
+    return 0
+
+
+def read_steps(script_file):
+    with (sys.stdin if script_file == "-" else open(script_file)) as script:
+        for line in script:
+            if line.strip() and not line.lstrip().startswith("#"):
+                yield shlex.split(line)
+
+
+def run_batch(script_file, keep_going=False):
+    exit_code = 0
+    for step in read_steps(script_file):
+        logging.info(f"Running step {shlex.join(step)}")
+        step_exit_code = run_step(step[0], step[1:])
+        if step_exit_code:
+            logging.error(f"Step {shlex.join(step)} failed with exit code {step_exit_code}")
+            exit_code = step_exit_code
+            if not keep_going:
+                break
+    return exit_code
+
+
+def init_logging(level):
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Entry point for all ci scripts',
+                                     epilog=f"Commands: {', '.join(TOOLS)}, batch. "
+                                            f"Use '<command> --help' for the arguments of a command")
+    parser.add_argument("--log-level", default="INFO", help="Log level of all commands")
+    parser.add_argument("--instrument", action="store_true", help="Record timings of instrumented calls")
+    parser.add_argument("--keep-going", action="store_true", help="Continue a batch after a failed step")
+    parser.add_argument("command", choices=[*TOOLS, "batch"],
+                        help="The command to run. 'batch FILE' runs one command per line of FILE ('-' for stdin) "
+                             "in this process, reusing sessions and parsed charts")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Arguments of the command")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.instrument:
+        os.environ["CI_SCRIPTS_INSTRUMENT"] = "1"
+    init_logging(args.log_level.upper())
+
+    if args.command == "batch":
+        if len(args.args) != 1:
+            logging.error("batch expects exactly one script file")
+            return 2
+        return run_batch(args.args[0], args.keep_going)
+    return run_step(args.command, args.args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
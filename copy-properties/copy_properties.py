@@ -1,10 +1,15 @@
 import argparse
+import functools
 import json
+import os
 import requests
 import sys
 import logging
 from itertools import islice
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "decorator"))
+from instrumentation import instrument  # noqa: E402
+
 
 class Artifactory:
 
@@ -35,21 +40,32 @@ class Artifactory:
         return f"{self.base_url}/artifactory"
 
 
+# Batch runs of several steps in one process share the session and skip the repeated ping
+@functools.lru_cache(maxsize=None)
+def connect(base_url: str, token: str) -> Artifactory:
+    return Artifactory(base_url=base_url, token=token)
+
+
 def init_logging():
     root = logging.getLogger()
-    root.setLevel(logging.DEBUG)
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setLevel(logging.DEBUG)
-    file_handler = logging.FileHandler('copy-properties.log')
-    file_handler.setLevel(logging.DEBUG)
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    file_handler.setFormatter(formatter)
-    root.addHandler(handler)
-    root.addHandler(file_handler)
-
-
-def parse_args():
+    # The console may already be set up by ci_scripts.py, the log file is written in any case
+    if not root.handlers:
+        root.setLevel(logging.DEBUG)
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setLevel(logging.DEBUG)
+        handler.setFormatter(formatter)
+        root.addHandler(handler)
+    log_file = os.path.abspath('copy-properties.log')
+    if not any(isinstance(handler, logging.FileHandler) and handler.baseFilename == log_file
+               for handler in root.handlers):
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.setFormatter(formatter)
+        root.addHandler(file_handler)
+
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("--token", help="The api token of the user")
     parser.add_argument("--base-url", help="The url to artifactory")
@@ -57,9 +73,10 @@ def parse_args():
     parser.add_argument("--source-file-path", help="The path the the source file")
     parser.add_argument("--target-file-path", help="The path the the target file")
     parser.add_argument("--properties-count", help="The number of properties to move", default=100)
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
+@instrument(size=lambda response: len((response or {}).get("properties", ())))
 def get_properties(artifactory, file_path):
     logging.info(f"Getting properties of file {file_path}")
     response = artifactory.session.get(f"{artifactory.item_url}/{file_path}?properties")
@@ -69,6 +86,7 @@ def get_properties(artifactory, file_path):
     return response.json()
 
 
+@instrument
 def add_properties(artifactory, properties, file_path):
     logging.info(f"Updating properties of file {file_path} with {len(properties)} properties")
     for prop_key, prop_value in properties.items():
@@ -81,6 +99,7 @@ def add_properties(artifactory, properties, file_path):
     return True
 
 
+@instrument
 def delete_properties(artifactory, properties, file_path):
     logging.info(f"Deleting {len(properties)} properties of file {file_path} ")
     props = ",".join(properties.keys())
@@ -91,10 +110,10 @@ def delete_properties(artifactory, properties, file_path):
     return True
 
 
-def main():
+def main(argv=None):
     init_logging()
-    args = parse_args()
-    artifactory = Artifactory(base_url=args.base_url, token=args.token)
+    args = parse_args(argv)
+    artifactory = connect(args.base_url, args.token)
     source_props = get_properties(artifactory, args.source_file_path)["properties"]
     logging.info(f"Got {len(source_props)} source properties")
     target_props = get_properties(artifactory, args.target_file_path)["properties"]
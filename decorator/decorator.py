@@ -1,15 +1,6 @@
 import logging
 import sys
-
-
-root = logging.getLogger()
-root.setLevel(logging.DEBUG)
-
-handler = logging.StreamHandler(sys.stdout)
-handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-root.addHandler(handler)
+import instrumentation
 
 
 class Multiplier:
@@ -19,18 +10,32 @@ class Multiplier:
 
 
 if __name__ == '__main__':
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handler.setFormatter(formatter)
+    root.addHandler(handler)
+
     def multiply_with_logging(func):
         def impl(*args, **kwargs):
-            logging.debug(f"Call to {func.__qualname__} with arguments {args[1:]}")
+            logging.debug("Call to %s with arguments %s", func.__qualname__, args[1:])
             ret_value = func(*args, **kwargs)
-            logging.debug(f"Call to {func.__qualname__} returned {ret_value}")
+            logging.debug("Call to %s returned %s", func.__qualname__, ret_value)
             return ret_value
         return impl
 
     multiplier = Multiplier()
     result = multiplier.multiply(3, 4)
-    logging.debug(f"Result is {result}")
+    logging.debug("Result is %s", result)
 
     Multiplier.multiply = multiply_with_logging(Multiplier.multiply)
     result = multiplier.multiply(3, 4)
-    logging.debug(f"Result is {result}")
+    logging.debug("Result is %s", result)
+
+    instrumentation.enable()
+    Multiplier.multiply = instrumentation.instrument(Multiplier.multiply, name="Multiplier.multiply")
+    for factor in range(1000):
+        multiplier.multiply(factor, 4)
@@ -0,0 +1,149 @@
+import atexit
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict
+
+ENV_ENABLED = "CI_SCRIPTS_INSTRUMENT"
+ENV_SAMPLE_RATE = "CI_SCRIPTS_INSTRUMENT_SAMPLE_RATE"
+
+logger = logging.getLogger("instrumentation")
+
+_enabled = os.environ.get(ENV_ENABLED, "").lower() not in ("", "0", "false", "no")
+_default_sample_rate = float(os.environ.get(ENV_SAMPLE_RATE, "1"))
+_registry: Dict[str, "CallStats"] = {}
+_registry_lock = threading.Lock()
+
+
+@dataclass
+class CallStats:
+    name: str
+    calls: int = 0
+    sampled: int = 0
+    errors: int = 0
+    wall_seconds: float = 0.0
+    max_wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    sizes: Dict[int, int] = field(default_factory=dict)
+    # Calls are recorded from worker threads as well, e.g. the report cleaner and the report sweeper
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def count_call(self):
+        with self._lock:
+            self.calls += 1
+
+    def record(self, wall_seconds, cpu_seconds, size, failed):
+        with self._lock:
+            self.sampled += 1
+            self.errors += failed
+            self.wall_seconds += wall_seconds
+            self.max_wall_seconds = max(self.max_wall_seconds, wall_seconds)
+            self.cpu_seconds += cpu_seconds
+            if size is not None:
+                bucket = 1 << size.bit_length() if size else 0
+                self.sizes[bucket] = self.sizes.get(bucket, 0) + 1
+
+    def as_dict(self):
+        with self._lock:
+            return self._as_dict()
+
+    def _as_dict(self):
+        sampled = self.sampled or 1
+        return {"name": self.name, "calls": self.calls, "sampled": self.sampled, "errors": self.errors,
+                "wall_seconds": round(self.wall_seconds, 6),
+                "avg_wall_ms": round(self.wall_seconds / sampled * 1e3, 3),
+                "max_wall_ms": round(self.max_wall_seconds * 1e3, 3), "cpu_seconds": round(self.cpu_seconds, 6),
+                "size_histogram": dict(sorted(self.sizes.items()))}
+
+
+# Takes effect for functions decorated before this call as well, the flag is checked on every call
+def enable(sample_rate=None):
+    global _enabled, _default_sample_rate
+    _enabled = True
+    if sample_rate is not None:
+        _default_sample_rate = sample_rate
+
+
+def is_enabled():
+    return _enabled
+
+
+def _argument_size(args, kwargs):
+    sizes = [len(value) for value in (*args, *kwargs.values())
+             if isinstance(value, (str, bytes, bytearray, list, tuple, dict, set))]
+    return sum(sizes) if sizes else None
+
+
+def _call_size(size, result, failed, args, kwargs):
+    if size is None:
+        return _argument_size(args, kwargs)
+    if failed:
+        return None
+    try:
+        return size(result)
+    except Exception as e:
+        # Instrumentation must never change the outcome of the call
+        logger.debug("Size of the result of a call could not be determined: %r", e)
+        return None
+
+
+# size is called with the result of a successful call and returns its size, e.g. the number of rows of a response.
+# Without it, the total length of sized arguments is recorded, if there are any
+def instrument(func=None, *, name=None, sample_rate=None, log_level=logging.DEBUG, size=None):
+    if func is None:
+        return functools.partial(instrument, name=name, sample_rate=sample_rate, log_level=log_level, size=size)
+
+    stats = _get_stats(name or func.__qualname__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        stats.count_call()
+        rate = _default_sample_rate if sample_rate is None else sample_rate
+        if rate < 1 and random.random() >= rate:
+            return func(*args, **kwargs)
+
+        failed = True
+        result = None
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            wall_seconds = time.perf_counter() - wall_start
+            cpu_seconds = time.thread_time() - cpu_start
+            call_size = _call_size(size, result, failed, args, kwargs)
+            stats.record(wall_seconds, cpu_seconds, call_size, failed)
+            if logger.isEnabledFor(log_level):
+                logger.log(log_level, "Call to %s took %.3f ms wall, %.3f ms cpu", stats.name,
+                           wall_seconds * 1e3, cpu_seconds * 1e3)
+
+    return wrapper
+
+
+def _get_stats(name):
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = CallStats(name)
+        return _registry[name]
+
+
+def report():
+    with _registry_lock:
+        return [stats.as_dict() for stats in sorted(_registry.values(), key=lambda s: s.wall_seconds, reverse=True)]
+
+
+def log_report(level=logging.INFO):
+    for stats in report():
+        if stats["calls"]:
+            logger.log(level, "%s", stats)
+
+
+atexit.register(log_report)
@@ -0,0 +1,66 @@
+import unittest
+from unittest import mock
+import instrumentation
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.multiple(instrumentation, _enabled=False, _default_sample_rate=1.0, _registry={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stats(self, name):
+        return {stats["name"]: stats for stats in instrumentation.report()}.get(name)
+
+    def test_disabled_calls_are_not_recorded(self):
+        double = instrumentation.instrument(lambda value: value * 2, name="double")
+        self.assertEqual(double(2), 4)
+        self.assertEqual(self.stats("double")["calls"], 0)
+
+    def test_enable_after_decoration(self):
+        double = instrumentation.instrument(lambda value: value * 2, name="double")
+        double(1)
+        instrumentation.enable()
+        self.assertEqual(double(2), 4)
+        self.assertEqual(self.stats("double")["calls"], 1)
+        self.assertEqual(self.stats("double")["sampled"], 1)
+
+    def test_sampling(self):
+        instrumentation.enable(sample_rate=0)
+        double = instrumentation.instrument(lambda value: value * 2, name="double")
+        for value in range(10):
+            self.assertEqual(double(value), value * 2)
+        self.assertEqual(self.stats("double")["calls"], 10)
+        self.assertEqual(self.stats("double")["sampled"], 0)
+
+    def test_errors_are_counted_and_raised(self):
+        instrumentation.enable()
+
+        @instrumentation.instrument(name="fail")
+        def fail():
+            raise ValueError("failed")
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(self.stats("fail")["errors"], 1)
+
+    def test_size_histogram(self):
+        instrumentation.enable()
+        rows = instrumentation.instrument(lambda count: list(range(count)), name="rows", size=len)
+        for count in (0, 1, 3, 100):
+            rows(count)
+        self.assertEqual(self.stats("rows")["size_histogram"], {0: 1, 2: 1, 4: 1, 128: 1})
+
+    def test_calls_without_size_are_not_in_histogram(self):
+        instrumentation.enable()
+        double = instrumentation.instrument(lambda value: value * 2, name="double")
+        double(2)
+        self.assertEqual(self.stats("double")["size_histogram"], {})
+
+    def test_failing_size_does_not_change_result(self):
+        instrumentation.enable()
+        search = instrumentation.instrument(lambda: None, name="search", size=len)
+        self.assertIsNone(search())
+        self.assertEqual(self.stats("search")["sampled"], 1)
+        self.assertEqual(self.stats("search")["size_histogram"], {})
+
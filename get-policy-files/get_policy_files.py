@@ -24,10 +24,16 @@ def get_policy_files_from_folder(folder):
     return filtered_files
 
 
-if __name__ == '__main__':
-    root = logging.getLogger()
-    root.setLevel(logging.DEBUG)
-    if len(sys.argv) < 1:
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 1:
         print('Need policy files folder')
         exit(1)
-    get_policy_files_from_folder(sys.argv[1])
+    for absolute_path, _ in get_policy_files_from_folder(argv[0]):
+        print(absolute_path)
+
+
+if __name__ == '__main__':
+    # The log level is left to ci_scripts.py when run through it
+    logging.getLogger().setLevel(logging.DEBUG)
+    main()
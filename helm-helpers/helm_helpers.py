@@ -7,6 +7,7 @@ import shutil
 import subprocess
 from typing import Dict
 import yaml
+from manifest_index import ManifestIndex, split_documents, tee_lines
 
 
 def to_string(obj):
@@ -54,6 +55,8 @@ class HelmRelease(FluxObject):
     repo_name: str = None
     values: HelmConfigValues = None
     values_config_map_name: str = None
+    namespace: str = None
+    release_name: str = None
 
 
 def build_git_repository(yaml_block) -> GitRepository:
@@ -70,9 +73,15 @@ def get_git_repository_tag(yaml_block) -> str:
 
 
 def build_helm_release(yaml_block) -> HelmRelease:
-    return HelmRelease(name=find("metadata/name", yaml_block), chart=find("spec/chart/spec/chart", yaml_block),
+    name = find("metadata/name", yaml_block)
+    target_namespace = find("spec/targetNamespace", yaml_block)
+    # Same defaults as the flux helm controller
+    release_name = find("spec/releaseName", yaml_block) or (f"{target_namespace}-{name}" if target_namespace else name)
+    return HelmRelease(name=name, chart=find("spec/chart/spec/chart", yaml_block),
                        repo_name=find("spec/chart/spec/sourceRef/name", yaml_block),
-                       values_config_map_name=find("spec/valuesFrom/[0]/name", yaml_block))
+                       values_config_map_name=find("spec/valuesFrom/[0]/name", yaml_block),
+                       namespace=target_namespace or find("metadata/namespace", yaml_block) or "default",
+                       release_name=release_name)
 
 
 def build_helm_values(yaml_block) -> HelmConfigValues | None:
@@ -123,17 +132,24 @@ def compose_helm_releases(flux_objects):
         yield release
 
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description='Render k8s manifests from flux helm releases')
     parser.add_argument('--base-dir', '-b', nargs='?', dest="base_path", required=True,
                         help='Path to folder containing the flux manifests')
     parser.add_argument('--work-dir', '-w', nargs='?', dest="work_dir", required=True, help='Path to working directory')
-
-    arguments = parser.parse_args()
+    parser.add_argument('--index-file', dest="index_file",
+                        help='File the index of rendered resources is written to. Defaults to '
+                             'manifest-index.json in the working directory')
+    parser.add_argument('--previous-index', dest="previous_index",
+                        help='Index of a previous render to diff against. Defaults to the existing index file')
+    parser.add_argument('--fail-on-conflict', dest="fail_on_conflict", action='store_true',
+                        help='Fail if two releases render the same resource with different content')
+
+    arguments = parser.parse_args(argv)
     return arguments
 
 
-def recreate_working_dir():
+def recreate_working_dir(working_dir):
     try:
         shutil.rmtree(working_dir)
     except FileNotFoundError:
@@ -141,21 +157,55 @@ def recreate_working_dir():
     os.mkdir(working_dir)
 
 
-if __name__ == '__main__':
-    args = parse_args()
+def render_release(helm_release, release_value_file_name, path_to_chart, generated_manifests_file, index):
+    # helm output is indexed while it is written, issues are reported as soon as a resource is rendered
+    issues = []
+    with open(generated_manifests_file, "w") as helm_output:
+        with subprocess.Popen(['helm', '-f', release_value_file_name, 'template', '--debug',
+                               '--namespace', helm_release.namespace, helm_release.release_name, path_to_chart],
+                              stdout=subprocess.PIPE, text=True) as helm:
+            documents = split_documents(tee_lines(helm.stdout, helm_output))
+            for issue in index.add_documents(helm_release.name, documents, helm_release.namespace):
+                print(issue)
+                issues.append(issue)
+    if helm.returncode != 0:
+        raise subprocess.CalledProcessError(helm.returncode, helm.args)
+    return issues
+
+
+def load_previous_index(index_file):
+    if not index_file or not os.path.exists(index_file):
+        return None
+    return ManifestIndex.load(index_file)
+
+
+def print_index_diff(index, previous_index):
+    diff = index.diff(previous_index)
+    for change, entries in diff.items():
+        for entry in sorted(entries, key=lambda e: (e.release, e.resource)):
+            print(f"{change.capitalize()}: {entry.resource} in release {entry.release}")
+    print(f"Compared to the previous render {len(diff['added'])} resources were added, "
+          f"{len(diff['removed'])} removed and {len(diff['changed'])} changed")
+
+
+def main(argv=None):
+    args = parse_args(argv)
 
     base_path = args.base_path
     working_dir = args.work_dir
-    path_to_git_repos = f"{base_path}/sources"
-    path_to_helm_releases = f"{base_path}/helmreleases"
-    path_to_config_maps = f"{base_path}/configmaps"
     output_dir = working_dir + "/generated"
+    index_file = args.index_file or working_dir + "/manifest-index.json"
 
     all_flux_objects = create_flux_objects_from_files(f"{base_path}/**/*.yaml")
 
-    recreate_working_dir()
+    # Read before the working directory, which may contain the previous index, is recreated
+    previous_index = load_previous_index(args.previous_index or index_file)
+
+    recreate_working_dir(working_dir)
     os.mkdir(output_dir)
 
+    index = ManifestIndex()
+    issues = []
     for helm_release in compose_helm_releases(all_flux_objects):
         git_clone_target_folder = f"{working_dir}/{helm_release.repo.name}"
         subprocess.run(['git', 'clone', '--depth', '1', '--branch', helm_release.repo.tag, helm_release.repo.url,
@@ -167,9 +217,22 @@ if __name__ == '__main__':
 
         path_to_chart = git_clone_target_folder + "/" + helm_release.chart
         generated_manifests_file = output_dir + "/" + helm_release.name + ".yaml"
-        with open(generated_manifests_file, "w") as helm_output:
-            subprocess.run(['helm', '-f', release_value_file_name, 'template', '--debug', path_to_chart],
-                           stdout=helm_output, check=True)
+        issues += render_release(helm_release, release_value_file_name, path_to_chart, generated_manifests_file,
+                                 index)
 
         assert os.path.exists(generated_manifests_file)
         assert os.path.getsize(generated_manifests_file) > 100
+
+    index.save(index_file)
+    print(f"Indexed {len(index.entries)} rendered resources in {index_file}")
+    if previous_index:
+        print_index_diff(index, previous_index)
+
+    conflicts = [issue for issue in issues if issue.type == "conflict"]
+    print(f"{len(issues) - len(conflicts)} duplicate and {len(conflicts)} conflicting resources found")
+    if conflicts and args.fail_on_conflict:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
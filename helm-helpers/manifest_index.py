@@ -0,0 +1,121 @@
+import hashlib
+import json
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, List, Tuple
+import yaml
+
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Kinds that are never namespaced, all other resources without a namespace end up in the namespace of the release
+CLUSTER_SCOPED_KINDS = {"APIService", "ClusterIssuer", "ClusterRole", "ClusterRoleBinding", "CSIDriver",
+                        "CustomResourceDefinition", "IngressClass", "MutatingWebhookConfiguration", "Namespace",
+                        "PersistentVolume", "PriorityClass", "StorageClass", "ValidatingWebhookConfiguration"}
+
+
+@dataclass
+class ManifestEntry:
+    release: str
+    kind: str
+    namespace: str
+    name: str
+    hash: str
+    source: str = None
+
+    @property
+    def resource(self):
+        return f"{self.kind}/{self.namespace}/{self.name}" if self.namespace else f"{self.kind}/{self.name}"
+
+
+@dataclass
+class ManifestIssue:
+    # "duplicate" if both releases render identical content, "conflict" otherwise
+    type: str
+    entry: ManifestEntry
+    existing: ManifestEntry
+
+    def __str__(self):
+        return f"{self.type.capitalize()}: {self.entry.resource} rendered by release {self.entry.release} " \
+               f"({self.entry.source}) is already rendered by release {self.existing.release} ({self.existing.source})"
+
+
+def tee_lines(lines: Iterable[str], output) -> Iterable[str]:
+    for line in lines:
+        output.write(line)
+        yield line
+
+
+def split_documents(lines: Iterable[str]) -> Iterable[str]:
+    # Separators are always at column 0, block scalars containing '---' are indented
+    document = []
+    for line in lines:
+        if line.startswith("---"):
+            if document:
+                yield "".join(document)
+            document = []
+        else:
+            document.append(line)
+    if document:
+        yield "".join(document)
+
+
+def document_source(document):
+    for line in document.splitlines():
+        if line.startswith("# Source: "):
+            return line[len("# Source: "):].strip()
+        if line.strip() and not line.startswith("#"):
+            return None
+    return None
+
+
+def document_hash(manifest):
+    # Hash of the parsed manifest, formatting and key order changes do not count as changes
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ManifestIndex:
+
+    def __init__(self, entries: List[ManifestEntry] = None):
+        self._by_resource: Dict[Tuple[str, str, str], List[ManifestEntry]] = {}
+        for entry in entries or []:
+            self._by_resource.setdefault((entry.kind, entry.namespace, entry.name), []).append(entry)
+
+    @property
+    def entries(self) -> List[ManifestEntry]:
+        return [entry for entries in self._by_resource.values() for entry in entries]
+
+    def add_document(self, release, document, namespace="") -> List[ManifestIssue]:
+        manifest = yaml.load(document, Loader=SafeLoader)
+        if not isinstance(manifest, dict) or "kind" not in manifest:
+            return []
+        metadata = manifest.get("metadata") or {}
+        if manifest["kind"] in CLUSTER_SCOPED_KINDS:
+            namespace = ""
+        entry = ManifestEntry(release=release, kind=manifest["kind"], namespace=metadata.get("namespace") or namespace,
+                              name=metadata.get("name") or "", hash=document_hash(manifest),
+                              source=document_source(document))
+        existing_entries = self._by_resource.setdefault((entry.kind, entry.namespace, entry.name), [])
+        issues = [ManifestIssue("duplicate" if existing.hash == entry.hash else "conflict", entry, existing)
+                  for existing in existing_entries]
+        existing_entries.append(entry)
+        return issues
+
+    def add_documents(self, release, documents: Iterable[str], namespace="") -> Iterable[ManifestIssue]:
+        for document in documents:
+            yield from self.add_document(release, document, namespace)
+
+    def diff(self, previous: "ManifestIndex") -> Dict[str, List[ManifestEntry]]:
+        current = {(entry.release, entry.kind, entry.namespace, entry.name): entry for entry in self.entries}
+        before = {(entry.release, entry.kind, entry.namespace, entry.name): entry for entry in previous.entries}
+        return {"added": [current[key] for key in current.keys() - before.keys()],
+                "removed": [before[key] for key in before.keys() - current.keys()],
+                "changed": [current[key] for key in current.keys() & before.keys()
+                            if current[key].hash != before[key].hash]}
+
+    def save(self, index_file):
+        with open(index_file, "w") as output:
+            json.dump([asdict(entry) for entry in self.entries], output)
+
+    @staticmethod
+    def load(index_file) -> "ManifestIndex":
+        with open(index_file) as index:
+            return ManifestIndex([ManifestEntry(**entry) for entry in json.load(index)])
@@ -0,0 +1,62 @@
+import io
+import unittest
+from manifest_index import ManifestIndex, split_documents, tee_lines
+
+RENDERED = """---
+# Source: app/templates/service.yaml
+apiVersion: v1
+kind: Service
+metadata:
+  name: app
+  namespace: apps
+---
+# Source: app/templates/config.yaml
+apiVersion: v1
+kind: ConfigMap
+metadata:
+  name: app-config
+data:
+  script: |
+    ---
+    echo hello
+"""
+
+
+class ManifestIndexTest(unittest.TestCase):
+
+    def test_split_documents(self):
+        output = io.StringIO()
+        documents = list(split_documents(tee_lines(io.StringIO(RENDERED), output)))
+        self.assertEqual(len(documents), 2)
+        self.assertIn("echo hello", documents[1])
+        self.assertEqual(output.getvalue(), RENDERED)
+
+    def test_duplicates_and_conflicts(self):
+        index = ManifestIndex()
+        self.assertEqual(list(index.add_documents("first", split_documents(io.StringIO(RENDERED)))), [])
+        duplicates = list(index.add_documents("second", split_documents(io.StringIO(RENDERED))))
+        self.assertEqual([issue.type for issue in duplicates], ["duplicate", "duplicate"])
+        conflicts = index.add_document("third", RENDERED.split("---")[1].replace("apps", "apps\n  labels: {a: b}"))
+        self.assertEqual([(issue.type, issue.existing.release) for issue in conflicts],
+                         [("conflict", "first"), ("conflict", "second")])
+
+    def test_diff(self):
+        previous = ManifestIndex()
+        list(previous.add_documents("app", split_documents(io.StringIO(RENDERED))))
+        current = ManifestIndex()
+        list(current.add_documents("app", split_documents(io.StringIO(RENDERED.replace("hello", "world")))))
+        current.add_document("app", "kind: Secret\nmetadata:\n  name: app-secret\n")
+        diff = current.diff(previous)
+        self.assertEqual([entry.resource for entry in diff["added"]], ["Secret/app-secret"])
+        self.assertEqual([entry.resource for entry in diff["changed"]], ["ConfigMap/app-config"])
+        self.assertEqual(diff["removed"], [])
+
+    def test_release_namespace_for_resources_without_namespace(self):
+        index = ManifestIndex()
+        list(index.add_documents("first", split_documents(io.StringIO(RENDERED)), "team-a"))
+        issues = index.add_documents("second", split_documents(io.StringIO(RENDERED)), "team-b")
+        self.assertEqual([issue.entry.resource for issue in issues], ["Service/apps/app"])
+        index.add_document("first", "kind: ClusterRole\nmetadata:\n  name: app\n", "team-a")
+        self.assertEqual(sorted(entry.resource for entry in index.entries),
+                         ["ClusterRole/app", "ConfigMap/team-a/app-config", "ConfigMap/team-b/app-config",
+                          "Service/apps/app", "Service/apps/app"])
@@ -56,15 +56,17 @@ def update_helm_release(release_file, src_repo_name):
             yaml.dump(doc, stream)
 
 
-if __name__ == '__main__':
-    if len(sys.argv) < 3:
+def main(argv=None):
+    global new_version
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 4:
         print('Need repo paths and commit message as arguments')
         exit(1)
 
-    helm_repo_path = sys.argv[1]
-    chart_path = sys.argv[2]
-    flux_repo_path = sys.argv[3]
-    message = sys.argv[4]
+    helm_repo_path = argv[0]
+    chart_path = argv[1]
+    flux_repo_path = argv[2]
+    message = argv[3]
 
     helm_repo = Repo(helm_repo_path)
 
@@ -82,3 +84,7 @@ if __name__ == '__main__':
     update_helm_release(flux_repo_path + "/sources/helm-repo.yaml", os.path.basename(os.path.normpath(helm_repo_path)))
     commit_changes(flux_repo, message)
     flux_repo.git.push('origin')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import ci_scripts
+
+
+def fake_tool(command):
+    def main(argv):
+        if argv[0] == "raise":
+            raise FileNotFoundError(argv[1])
+        if argv[0] == "exit":
+            exit(int(argv[1]) if argv[1].isdigit() else argv[1])
+        fake_tool.calls.append((command, argv))
+    return mock.Mock(main=main)
+
+
+@mock.patch("ci_scripts.load_tool", side_effect=fake_tool)
+class RunStepTest(unittest.TestCase):
+
+    def setUp(self):
+        fake_tool.calls = []
+        self.script = tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False)
+        self.addCleanup(os.remove, self.script.name)
+
+    def write_steps(self, content):
+        self.script.write(content)
+        self.script.close()
+        return self.script.name
+
+    def test_exit_codes(self, load_tool):
+        self.assertEqual(ci_scripts.run_step("users", ["ok"]), 0)
+        self.assertEqual(ci_scripts.run_step("users", ["exit", "0"]), 0)
+        self.assertEqual(ci_scripts.run_step("users", ["exit", "3"]), 3)
+        self.assertEqual(ci_scripts.run_step("users", ["exit", "message"]), 1)
+        self.assertEqual(ci_scripts.run_step("unknown", ["ok"]), 2)
+
+    def test_exception_fails_the_step(self, load_tool):
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(ci_scripts.run_step("bump-dep", ["raise", "/nonexistent/Chart.yaml"]), 1)
+
+    def test_batch_stops_at_failing_step(self, load_tool):
+        script = self.write_steps("# comment\nusers ok\n\nbump-dep raise Chart.yaml\npolicies ok\n")
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(ci_scripts.run_batch(script), 1)
+        self.assertEqual(fake_tool.calls, [("users", ["ok"])])
+
+    def test_batch_keep_going(self, load_tool):
+        script = self.write_steps("bump-dep raise Chart.yaml\npolicies 'some dir'\nusers exit 3\n")
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(ci_scripts.run_batch(script, keep_going=True), 3)
+        self.assertEqual(fake_tool.calls, [("policies", ["some dir"])])
@@ -0,0 +1,134 @@
+import argparse
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Set
+from update_chart_version import increment_patch_version
+from update_helm_dependency import dump_chart, find_chart_files, index_dependencies, load_chart
+
+
+@dataclass
+class ChartNode:
+    name: str
+    chart_file: str
+    version: str
+    dependencies: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class ChartUpdate:
+    name: str
+    chart_file: str
+    current_version: str
+    new_version: str
+    pins: Dict[str, str] = field(default_factory=dict)
+
+
+class ChartGraph:
+
+    def __init__(self, charts: Dict[str, ChartNode]):
+        self._charts = charts
+        self._dependents = {name: set() for name in charts}
+        for chart in charts.values():
+            for dependency_name in chart.dependencies:
+                if dependency_name in self._dependents:
+                    self._dependents[dependency_name].add(chart.name)
+
+    @classmethod
+    def from_directory(cls, chart_dir):
+        charts = {}
+        for chart_file in find_chart_files(chart_dir):
+            chart = load_chart(chart_file)
+            name = chart["name"]
+            if name in charts:
+                raise ValueError(f'Chart {name} is defined in {charts[name].chart_file} and {chart_file}')
+            charts[name] = ChartNode(name, chart_file, str(chart.get("version")),
+                                     set(index_dependencies(chart).keys()))
+        return cls(charts)
+
+    @property
+    def charts(self):
+        return self._charts
+
+    def dependents(self, name) -> Set[str]:
+        return self._dependents[name]
+
+    def downstream(self, names) -> List[str]:
+        unknown = [name for name in names if name not in self._charts]
+        if unknown:
+            raise KeyError(f'Unknown charts {unknown}')
+
+        affected = set()
+        pending = deque(names)
+        while pending:
+            name = pending.popleft()
+            if name not in affected:
+                affected.add(name)
+                pending.extend(self._dependents[name])
+
+        in_degree = {name: len(self._charts[name].dependencies & affected) for name in affected}
+        ready = deque(sorted(name for name, degree in in_degree.items() if degree == 0))
+        ordered = []
+        while ready:
+            name = ready.popleft()
+            ordered.append(name)
+            for dependent in sorted(self._dependents[name]):
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    ready.append(dependent)
+
+        if len(ordered) != len(affected):
+            raise ValueError(f'Dependency cycle between charts {sorted(affected - set(ordered))}')
+        return ordered
+
+    def plan(self, bumped_charts, already_bumped=False) -> List[ChartUpdate]:
+        new_versions = {}
+        updates = []
+        for name in self.downstream(bumped_charts):
+            chart = self._charts[name]
+            if already_bumped and name in bumped_charts:
+                new_version = chart.version
+            else:
+                new_version = str(increment_patch_version(chart.version))
+            new_versions[name] = new_version
+            pins = {dependency: new_versions[dependency] for dependency in chart.dependencies
+                    if dependency in new_versions}
+            updates.append(ChartUpdate(name, chart.chart_file, chart.version, new_version, pins))
+        return updates
+
+
+def apply_updates(updates: List[ChartUpdate]):
+    for update in updates:
+        chart = load_chart(update.chart_file)
+        chart["version"] = update.new_version
+        dependencies = index_dependencies(chart)
+        for dependency_name, version in update.pins.items():
+            for dependency in dependencies[dependency_name]:
+                dependency["version"] = version
+        dump_chart(chart, update.chart_file)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Bump charts and propagate the new versions to all dependent charts')
+    parser.add_argument('--chart-dir', required=True, help='Directory containing the Chart.yaml files')
+    parser.add_argument('--already-bumped', action='store_true',
+                        help='The given charts already carry their new version and only dependents are bumped')
+    parser.add_argument('--dry-run', action='store_true', help='Only print the planned updates')
+    parser.add_argument('charts', nargs='+', help='Names of the bumped charts')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    graph = ChartGraph.from_directory(args.chart_dir)
+    print(f'Found {len(graph.charts)} charts in {os.path.abspath(args.chart_dir)}')
+    planned_updates = graph.plan(args.charts, args.already_bumped)
+
+    for planned_update in planned_updates:
+        print(f'{planned_update.name} ({planned_update.chart_file}): '
+              f'{planned_update.current_version} -> {planned_update.new_version}, pins {planned_update.pins}')
+
+    if not args.dry_run:
+        apply_updates(planned_updates)
+        print(f'{len(planned_updates)} charts updated')
@@ -0,0 +1,38 @@
+import unittest
+from chart_graph import ChartGraph, ChartNode
+
+
+class ChartGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = ChartGraph({
+            "base": ChartNode("base", "base/Chart.yaml", "1.0.0"),
+            "lib": ChartNode("lib", "lib/Chart.yaml", "2.1.0", {"base"}),
+            "app": ChartNode("app", "app/Chart.yaml", "0.3.4", {"lib", "base", "external"}),
+            "other": ChartNode("other", "other/Chart.yaml", "1.0.0", {"external"}),
+        })
+
+    def test_downstream_is_topologically_ordered(self):
+        self.assertEqual(self.graph.downstream(["base"]), ["base", "lib", "app"])
+
+    def test_downstream_excludes_unaffected_charts(self):
+        self.assertEqual(self.graph.downstream(["lib"]), ["lib", "app"])
+
+    def test_plan_bumps_and_pins_dependents(self):
+        updates = {update.name: update for update in self.graph.plan(["base"])}
+        self.assertEqual(updates["base"].new_version, "1.0.1")
+        self.assertEqual(updates["lib"].new_version, "2.1.1")
+        self.assertEqual(updates["lib"].pins, {"base": "1.0.1"})
+        self.assertEqual(updates["app"].pins, {"base": "1.0.1", "lib": "2.1.1"})
+
+    def test_plan_keeps_version_of_already_bumped_charts(self):
+        updates = {update.name: update for update in self.graph.plan(["base"], already_bumped=True)}
+        self.assertEqual(updates["base"].new_version, "1.0.0")
+        self.assertEqual(updates["lib"].pins, {"base": "1.0.0"})
+
+    def test_cycle_is_detected(self):
+        graph = ChartGraph({
+            "a": ChartNode("a", "a/Chart.yaml", "1.0.0", {"b"}),
+            "b": ChartNode("b", "b/Chart.yaml", "1.0.0", {"a"}),
+        })
+        self.assertRaises(ValueError, graph.downstream, ["a"])
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import yaml
+import update_helm_dependency
+from update_helm_dependency import bulk_update, find_chart_files, is_subchart, load_chart, parse_pins, \
+    pin_dependencies
+
+CHART = """apiVersion: v2
+name: app
+version: 1.0.0
+dependencies:
+- name: base
+  version: 1.0.0
+- name: lib
+  version: 2.0.0
+"""
+
+
+class PinDependenciesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chart_dir = tempfile.TemporaryDirectory()
+        self.chart_file = self.write_chart("app", CHART)
+
+    def tearDown(self):
+        self.chart_dir.cleanup()
+
+    def write_chart(self, name, content):
+        os.makedirs(os.path.join(self.chart_dir.name, name))
+        chart_file = os.path.join(self.chart_dir.name, name, "Chart.yaml")
+        with open(chart_file, "w") as chart:
+            chart.write(content)
+        return chart_file
+
+    def test_pin_dependencies_updates_only_changed_versions(self):
+        result = pin_dependencies(self.chart_file, {"base": "1.1.0", "lib": "2.0.0", "other": "3.0.0"})
+        self.assertTrue(result.ok)
+        self.assertEqual(result.updated, {"base": "1.0.0 -> 1.1.0"})
+        with open(self.chart_file) as chart:
+            dependencies = yaml.safe_load(chart)["dependencies"]
+        self.assertEqual([dependency["version"] for dependency in dependencies], ["1.1.0", "2.0.0"])
+
+    def test_pin_dependencies_leaves_unaffected_chart_untouched(self):
+        modified = os.stat(self.chart_file).st_mtime_ns
+        result = pin_dependencies(self.chart_file, {"lib": "2.0.0"})
+        self.assertTrue(result.ok)
+        self.assertEqual(result.updated, {})
+        self.assertEqual(os.stat(self.chart_file).st_mtime_ns, modified)
+
+    def test_bulk_update_reports_errors_per_file(self):
+        broken_file = self.write_chart("broken", "name: broken\ndependencies: [{name: base}]\n")
+        results = {result.chart_file: result for result in bulk_update([self.chart_file, broken_file],
+                                                                        {"base": "1.1.0"}, workers=1)}
+        self.assertTrue(results[self.chart_file].ok)
+        self.assertEqual(results[self.chart_file].updated, {"base": "1.0.0 -> 1.1.0"})
+        self.assertFalse(results[broken_file].ok)
+        self.assertIn("KeyError", results[broken_file].error)
+
+    def test_parse_pins(self):
+        self.assertEqual(parse_pins(["base=1.1.0", "lib=2.0.0"]), {"base": "1.1.0", "lib": "2.0.0"})
+        self.assertRaises(ValueError, parse_pins, ["base"])
+        self.assertRaises(ValueError, parse_pins, ["base="])
+
+    def test_find_chart_files_skips_vendored_subcharts(self):
+        subchart_file = self.write_chart(os.path.join("app", "charts", "base"), "name: base\nversion: 1.0.0\n")
+        self.assertTrue(is_subchart(subchart_file))
+        self.assertFalse(is_subchart(self.chart_file))
+        self.assertEqual(find_chart_files(self.chart_dir.name), [self.chart_file])
+        self.assertEqual(find_chart_files(os.path.join(self.chart_dir.name, "**", "Chart.yaml")), [self.chart_file])
+
+    @mock.patch.dict(update_helm_dependency._chart_cache, clear=True)
+    def test_load_chart_returns_copies_of_cached_chart(self):
+        load_chart(self.chart_file)["dependencies"][0]["version"] = "9.9.9"
+        self.assertEqual(load_chart(self.chart_file)["dependencies"][0]["version"], "1.0.0")
+        self.assertEqual(len(update_helm_dependency._chart_cache), 1)
+
+    @mock.patch.dict(update_helm_dependency._chart_cache, clear=True)
+    @mock.patch("update_helm_dependency._cache_charts", False)
+    def test_charts_are_not_cached_when_disabled(self):
+        self.assertTrue(pin_dependencies(self.chart_file, {"base": "1.1.0"}).ok)
+        self.assertEqual(update_helm_dependency._chart_cache, {})
@@ -3,14 +3,19 @@ import yaml
 import semantic_version
 
 
-def update_version():
+def increment_patch_version(version) -> semantic_version.Version:
+    current_version = semantic_version.Version(str(version))
+    return semantic_version.Version(major=current_version.major,
+                                    minor=current_version.minor, patch=current_version.patch + 1)
+
+
+def update_version(chart_file):
     with open(chart_file, 'r') as chart_yaml:
         chart = yaml.load(chart_yaml, Loader=yaml.FullLoader)
 
         current_version = semantic_version.Version(chart.get("version"))
         print(f'Current chart version is {current_version}')
-        new_version = semantic_version.Version(major=current_version.major,
-                                               minor=current_version.minor, patch=current_version.patch + 1)
+        new_version = increment_patch_version(current_version)
         print(f'New chart version is {new_version}')
         chart["version"] = str(new_version)
 
@@ -20,9 +25,8 @@ def update_version():
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 1:
+    if len(sys.argv) < 2:
         print('Need chart file')
         exit(1)
 
-    chart_file = sys.argv[1]
-    update_version()
+    update_version(sys.argv[1])
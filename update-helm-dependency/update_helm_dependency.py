@@ -1,37 +1,203 @@
-import sys
+import argparse
+import copy
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List
 import yaml
 
 
-def update_dependency_version():
-    with open(chart_file, 'r') as chart_yaml:
+@dataclass
+class PinResult:
+    chart_file: str
+    updated: Dict[str, str] = field(default_factory=dict)
+    error: str = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+# Parsed charts by real path, reused while size and mtime of the file are unchanged. Callers get copies since they
+# modify the charts they load. Only useful when one process loads a chart repeatedly, e.g. in a ci_scripts.py batch,
+# so the workers of bulk updates do not cache.
+_chart_cache = {}
+_cache_charts = True
+
+
+def _disable_chart_cache():
+    global _cache_charts
+    _cache_charts = False
+
+
+def _file_signature(chart_file):
+    stat = os.stat(chart_file)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_chart(chart_file):
+    if not _cache_charts:
+        with open(chart_file, 'r') as chart_yaml:
+            return yaml.load(chart_yaml, Loader=yaml.FullLoader)
+    path = os.path.realpath(chart_file)
+    signature = _file_signature(path)
+    cached = _chart_cache.get(path)
+    if cached and cached[0] == signature:
+        return copy.deepcopy(cached[1])
+    with open(path, 'r') as chart_yaml:
         chart = yaml.load(chart_yaml, Loader=yaml.FullLoader)
+    _chart_cache[path] = (signature, copy.deepcopy(chart))
+    return chart
 
-        dependency_fount = False
-        for dependency in chart["dependencies"]:
-            if dependency["name"] == dependency_name:
-                print(f'Found dependency {dependency_name}')
-                print(f'Current version is {dependency["version"]}')
-                print(f'Setting new version is {new_version}')
-                dependency["version"] = new_version
-                dependency_fount = True
-                break
-
-        if not dependency_fount:
-            print(f'Dependency {dependency_name} not found')
-            exit(1)
-        else:
-            print(f'Dependency {dependency_name} updated to {new_version}')
-            with open(chart_file, 'w') as stream:
-                yaml.dump(chart, stream, sort_keys=False)
 
+def dump_chart(chart, chart_file):
+    path = os.path.realpath(chart_file)
+    with open(path, 'w') as stream:
+        yaml.dump(chart, stream, sort_keys=False)
+    if _cache_charts:
+        _chart_cache[path] = (_file_signature(path), copy.deepcopy(chart))
 
-if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print('Need chart file, dependency name and version')
+
+def index_dependencies(chart) -> Dict[str, List[dict]]:
+    index = {}
+    for dependency in chart.get("dependencies") or []:
+        index.setdefault(dependency["name"], []).append(dependency)
+    return index
+
+
+def pin_dependencies(chart_file, pins: Dict[str, str]) -> PinResult:
+    result = PinResult(chart_file)
+    try:
+        chart = load_chart(chart_file)
+        index = index_dependencies(chart)
+        for dependency_name in pins.keys() & index.keys():
+            new_version = pins[dependency_name]
+            for dependency in index[dependency_name]:
+                if dependency["version"] != new_version:
+                    result.updated[dependency_name] = f'{dependency["version"]} -> {new_version}'
+                    dependency["version"] = new_version
+        if result.updated:
+            dump_chart(chart, chart_file)
+    except Exception as e:
+        result.error = f'{e.__class__.__name__}: {e}'
+    return result
+
+
+def is_subchart(chart_file):
+    # Vendored subcharts live in the charts/ directory of their parent chart
+    directory = os.path.dirname(os.path.abspath(chart_file))
+    while os.path.dirname(directory) != directory:
+        parent = os.path.dirname(directory)
+        if os.path.basename(directory) == 'charts' and os.path.isfile(os.path.join(parent, 'Chart.yaml')):
+            return True
+        directory = parent
+    return False
+
+
+def find_chart_files(path_or_glob):
+    if os.path.isdir(path_or_glob):
+        chart_files = glob.glob(os.path.join(path_or_glob, '**', 'Chart.yaml'), recursive=True)
+    else:
+        chart_files = glob.glob(path_or_glob, recursive=True)
+    return sorted(chart_file for chart_file in chart_files if not is_subchart(chart_file))
+
+
+def parse_pins(pin_args) -> Dict[str, str]:
+    pins = {}
+    for pin in pin_args:
+        name, separator, version = pin.partition('=')
+        if not separator or not name or not version:
+            raise ValueError(f'Invalid pin {pin}, expected name=version')
+        pins[name] = version
+    return pins
+
+
+def bulk_update(chart_files, pins: Dict[str, str], workers=None) -> List[PinResult]:
+    with ProcessPoolExecutor(max_workers=workers, initializer=_disable_chart_cache) as executor:
+        return list(executor.map(pin_dependencies, chart_files, [pins] * len(chart_files),
+                                 chunksize=max(1, len(chart_files) // 64)))
+
+
+def update_dependency_version(chart_file, dependency_name, new_version):
+    chart = load_chart(chart_file)
+    dependencies = index_dependencies(chart).get(dependency_name)
+
+    if not dependencies:
+        print(f'Dependency {dependency_name} not found')
         exit(1)
 
-    chart_file = sys.argv[1]
-    dependency_name = sys.argv[2]
-    new_version = sys.argv[3]
+    for dependency in dependencies:
+        print(f'Found dependency {dependency_name}')
+        print(f'Current version is {dependency["version"]}')
+        print(f'Setting new version is {new_version}')
+        dependency["version"] = new_version
+
+    print(f'Dependency {dependency_name} updated to {new_version}')
+    dump_chart(chart, chart_file)
+
 
-    update_dependency_version()
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} is not a positive number')
+    return number
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Update dependency versions in Chart.yaml files',
+                                     usage='%(prog)s chart_file dependency_name version\n'
+                                           '       %(prog)s --bulk CHARTS [--workers N] '
+                                           'name=version [name=version ...]')
+    parser.add_argument('--bulk', dest='charts',
+                        help='Directory to search for Chart.yaml files or a glob pattern matching chart files. '
+                             'Pins all given dependencies in all of them')
+    parser.add_argument('--workers', type=positive_int, default=None, help='Number of parallel worker processes')
+    parser.add_argument('arguments', nargs='+',
+                        help='Chart file, dependency name and version, or dependency pins name=version with --bulk')
+    args = parser.parse_args(argv)
+    if not args.charts and len(args.arguments) != 3:
+        parser.error('Need chart file, dependency name and version')
+    if args.workers and not args.charts:
+        parser.error('--workers is only supported with --bulk')
+    return args
+
+
+def run_bulk(charts, pin_args, workers=None):
+    try:
+        pins = parse_pins(pin_args)
+    except ValueError as e:
+        print(e)
+        exit(1)
+    chart_files = find_chart_files(charts)
+    if not chart_files:
+        print(f'No chart files found for {charts}')
+        exit(1)
+
+    print(f'Pinning {pins} in {len(chart_files)} chart files')
+    results = bulk_update(chart_files, pins, workers)
+
+    for result in results:
+        if not result.ok:
+            print(f'{result.chart_file}: failed: {result.error}')
+        elif result.updated:
+            print(f'{result.chart_file}: updated {result.updated}')
+        else:
+            print(f'{result.chart_file}: unchanged')
+
+    failed = [result for result in results if not result.ok]
+    updated = [result for result in results if result.ok and result.updated]
+    print(f'{len(updated)} charts updated, {len(results) - len(updated) - len(failed)} unchanged, {len(failed)} failed')
+    exit(1 if failed else 0)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.charts:
+        run_bulk(args.charts, args.arguments, args.workers)
+    else:
+        update_dependency_version(*args.arguments)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,14 @@
 import argparse
+import functools
+import os
 import time
 import requests
 import sys
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "decorator"))
+from instrumentation import instrument  # noqa: E402
+
 
 class Artifactory:
 
@@ -30,28 +35,40 @@ class Artifactory:
         return f"{self.base_url}/artifactory/api"
 
 
+# Batch runs of several steps in one process share the session and skip the repeated ping
+@functools.lru_cache(maxsize=None)
+def connect(base_url: str, token: str) -> Artifactory:
+    return Artifactory(base_url=base_url, token=token)
+
+
 def init_logging():
     root = logging.getLogger()
-    root.setLevel(logging.DEBUG)
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setLevel(logging.INFO)
-    file_handler = logging.FileHandler('update_users.log')
-    file_handler.setLevel(logging.INFO)
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    file_handler.setFormatter(formatter)
-    root.addHandler(handler)
-    root.addHandler(file_handler)
-
-
-def parse_args():
+    # The console may already be set up by ci_scripts.py, the log file is written in any case
+    if not root.handlers:
+        root.setLevel(logging.DEBUG)
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setLevel(logging.INFO)
+        handler.setFormatter(formatter)
+        root.addHandler(handler)
+    log_file = os.path.abspath('update_users.log')
+    if not any(isinstance(handler, logging.FileHandler) and handler.baseFilename == log_file
+               for handler in root.handlers):
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setLevel(logging.INFO)
+        file_handler.setFormatter(formatter)
+        root.addHandler(file_handler)
+
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("--token", help="The api token of the user")
     parser.add_argument("--base-url", help="The url to artifactory")
     parser.add_argument("--dry-run", help="The url to artifactory", default=True)
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
+@instrument(size=lambda users: len(users or ()))
 def get_users(artifactory):
     logging.info("Getting all users")
     response = artifactory.session.get(f"{artifactory.api_url}/security/users")
@@ -80,6 +97,7 @@ def filter_user(user):
     return True
 
 
+@instrument
 def update_users(artifactory, dry_run=True, delay_in_seconds=2):
     all_users = get_users(artifactory)
     filtered_users = filter_users(all_users)
@@ -130,10 +148,10 @@ def update_users(artifactory, dry_run=True, delay_in_seconds=2):
     logging.info(f"{updates_done} users updated")
 
 
-def main():
+def main(argv=None):
     init_logging()
-    args = parse_args()
-    artifactory = Artifactory(base_url=args.base_url, token=args.token)
+    args = parse_args(argv)
+    artifactory = connect(args.base_url, args.token)
     update_users(artifactory, args.dry_run)
 
 
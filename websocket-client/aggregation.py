@@ -0,0 +1,121 @@
+import heapq
+import json
+import re
+import sys
+import time
+from array import array
+
+OTHER_GROUP = "__other__"
+
+
+class WindowedCounter:
+
+    def __init__(self, buckets):
+        self._counts = array('Q', [0] * buckets)
+        self._epochs = array('q', [-1] * buckets)
+
+    def add(self, epoch, amount=1):
+        index = epoch % len(self._epochs)
+        if self._epochs[index] != epoch:
+            if self._epochs[index] > epoch:
+                return
+            self._epochs[index] = epoch
+            self._counts[index] = 0
+        self._counts[index] += amount
+
+    def total(self, current_epoch):
+        oldest_epoch = current_epoch - len(self._epochs)
+        return sum(count for count, epoch in zip(self._counts, self._epochs) if oldest_epoch < epoch <= current_epoch)
+
+
+class GroupedCounter:
+
+    def __init__(self, buckets, max_groups):
+        self._buckets = buckets
+        self._max_groups = max_groups
+        self._counters = {}
+        self._latest_epoch = None
+        self._evicted_epoch = None
+
+    def add(self, group, epoch, amount=1):
+        if self._latest_epoch is None or epoch > self._latest_epoch:
+            self._latest_epoch = epoch
+        counter = self._counters.get(group)
+        if counter is None:
+            if len(self._counters) >= self._max_groups:
+                self._evict_idle_groups()
+            if len(self._counters) >= self._max_groups:
+                group = OTHER_GROUP
+            counter = self._counters.setdefault(group, WindowedCounter(self._buckets))
+        counter.add(epoch, amount)
+
+    def _evict_idle_groups(self):
+        # Groups without entries in the window, e.g. of replaced pods, make room for new ones. Groups only become
+        # idle when the window moves, so there is nothing new to evict until the latest epoch changes
+        if self._evicted_epoch == self._latest_epoch:
+            return
+        self._evicted_epoch = self._latest_epoch
+        for group in [group for group, counter in self._counters.items() if not counter.total(self._latest_epoch)]:
+            del self._counters[group]
+
+    def totals(self, current_epoch):
+        return {group: counter.total(current_epoch) for group, counter in self._counters.items()}
+
+
+class WindowAggregator:
+
+    def __init__(self, output=None, window_seconds=60, bucket_seconds=10, group_by=None, patterns=None,
+                 top=10, emit_interval=10, max_groups=1000):
+        if window_seconds % bucket_seconds:
+            raise ValueError("The window must be a multiple of the bucket size")
+        self._output = output or open(sys.stdout.fileno(), "wb", closefd=False)
+        self._window_seconds = window_seconds
+        self._bucket_ns = int(bucket_seconds * 1e9)
+        self._group_by = group_by
+        self._patterns = {name: re.compile(pattern) for name, pattern in (patterns or {}).items()}
+        self._top = top
+        self._emit_interval = emit_interval
+        buckets = int(window_seconds // bucket_seconds)
+        self._entries = GroupedCounter(buckets, max_groups)
+        self._matches = {name: GroupedCounter(buckets, max_groups) for name in self._patterns}
+        self._current_epoch = None
+        self._next_emit = time.monotonic() + emit_interval
+
+    def write_stream(self, labels, labels_key, values, query=None):
+        group = labels.get(self._group_by, "") if self._group_by else labels_key
+        for ts, line in values:
+            epoch = int(ts) // self._bucket_ns
+            if self._current_epoch is None or epoch > self._current_epoch:
+                self._current_epoch = epoch
+            self._entries.add(group, epoch)
+            for name, pattern in self._patterns.items():
+                if pattern.search(line):
+                    self._matches[name].add(group, epoch)
+        # A busy consumer rarely has an empty queue and calls flush, summaries are due at peak load as well
+        self.flush()
+
+    def summary(self):
+        entries = self._entries.totals(self._current_epoch)
+        summary = self._counts_summary(entries)
+        summary["window_end"] = (self._current_epoch + 1) * self._bucket_ns
+        summary["window_seconds"] = self._window_seconds
+        summary["matches"] = {name: self._counts_summary(counter.totals(self._current_epoch))
+                              for name, counter in self._matches.items()}
+        return summary
+
+    def _counts_summary(self, counts):
+        total = sum(counts.values())
+        top = heapq.nlargest(self._top, ((count, group) for group, count in counts.items() if count))
+        return {"total": total, "rate": round(total / self._window_seconds, 3),
+                "top": [[group, count] for count, group in top]}
+
+    def emit(self):
+        if self._current_epoch is None:
+            return
+        self._next_emit = time.monotonic() + self._emit_interval
+        self._output.write((json.dumps(self.summary(), separators=(",", ":")) + "\n").encode())
+        self._output.flush()
+
+    def flush(self):
+        if time.monotonic() >= self._next_emit:
+            self.emit()
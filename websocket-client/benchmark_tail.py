@@ -0,0 +1,127 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from websocket_client import JsonLinesWriter, LokiTail, TailConsumer
+
+SCENARIOS = {
+    "small-lines": {"streams": 10, "line_size": 100, "rate": 0, "burst": 100},
+    "large-lines": {"streams": 10, "line_size": 4096, "rate": 0, "burst": 20},
+    "many-streams": {"streams": 1000, "line_size": 200, "rate": 0, "burst": 500},
+    "steady-20k": {"streams": 50, "line_size": 200, "rate": 20000, "burst": 100},
+}
+
+
+class LatencySink:
+    # Latencies are counted in a fixed set of logarithmic buckets, 5% apart and up to 100s, so the memory of the
+    # benchmark does not grow with the throughput it measures
+    BUCKET_GROWTH = 1.05
+    BUCKETS = int(math.log(100e6) / math.log(BUCKET_GROWTH)) + 1
+
+    def __init__(self, sink):
+        self._sink = sink
+        self._histogram = array('Q', [0] * self.BUCKETS)
+        self.first_entry = None
+
+    def write_stream(self, labels, labels_key, values, query=None):
+        now = time.time_ns()
+        if self.first_entry is None:
+            self.first_entry = time.monotonic()
+        latency_us = max(1, (now - int(values[0][0])) // 1000)
+        self._histogram[min(int(math.log(latency_us) / math.log(self.BUCKET_GROWTH)), self.BUCKETS - 1)] += len(values)
+        self._sink.write_stream(labels, labels_key, values, query)
+
+    def flush(self):
+        self._sink.flush()
+
+    def percentile(self, percent):
+        # Upper bound of the bucket containing the percentile, in nanoseconds
+        total = sum(self._histogram)
+        if not total:
+            return None
+        threshold = total * percent / 100
+        seen = 0
+        for index, count in enumerate(self._histogram):
+            seen += count
+            if seen >= threshold:
+                return self.BUCKET_GROWTH ** (index + 1) * 1000
+        return self.BUCKET_GROWTH ** self.BUCKETS * 1000
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub(port, streams, line_size, rate, burst):
+    stub = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "loki_stub.py"),
+                             "--port", str(port), "--streams", str(streams), "--line-size", str(line_size),
+                             "--rate", str(rate), "--burst", str(burst)], stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("localhost", port), timeout=1).close()
+            return stub
+        except OSError:
+            time.sleep(0.1)
+    stub.kill()
+    raise RuntimeError(f"Loki tail stub did not start on port {port}")
+
+
+def run_scenario(name, scenario, duration, queue_size, drop_when_full):
+    port = free_port()
+    stub = start_stub(port, **scenario)
+    try:
+        sink = LatencySink(JsonLinesWriter(open(os.devnull, "wb", buffering=1024 * 1024)))
+        consumer = TailConsumer(sink, queue_size, drop_when_full)
+        consumer.start()
+        tail = LokiTail(consumer, f"ws://localhost:{port}", '{app="loki-stub"}')
+        timer = threading.Timer(duration, tail.stop)
+        timer.start()
+        tail.run()
+        stopped = time.monotonic()
+        consumer.stop()
+        drained = time.monotonic()
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    stats = consumer.stats()
+    elapsed = drained - sink.first_entry if sink.first_entry else None
+    return {"scenario": name, **scenario, "entries": stats["entries"],
+            "entries_per_second": round(stats["entries"] / elapsed) if elapsed else 0,
+            "p50_latency_ms": round((sink.percentile(50) or 0) / 1e6, 2),
+            "p99_latency_ms": round((sink.percentile(99) or 0) / 1e6, 2),
+            "drain_seconds": round(drained - stopped, 3), "dropped": stats["dropped"], "blocked": stats["blocked"],
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure throughput, latency and memory of the loki tail consumer '
+                                                 'against a local loki tail stub')
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run, can be repeated. Defaults to all scenarios")
+    parser.add_argument("--duration", type=float, default=10, help="Duration of each scenario in seconds")
+    parser.add_argument("--queue-size", type=int, default=10000, help="Queue size of the consumer")
+    parser.add_argument("--drop-when-full", action="store_true", help="Drop messages when the queue is full")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for scenario_name in args.scenario or sorted(SCENARIOS):
+        # Every scenario runs in a fresh process so peak RSS is measured per scenario
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            result = executor.submit(run_scenario, scenario_name, SCENARIOS[scenario_name], args.duration,
+                                     args.queue_size, args.drop_when_full).result()
+        print(json.dumps(result), flush=True)
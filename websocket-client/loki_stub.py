@@ -0,0 +1,77 @@
+import argparse
+import asyncio
+import json
+import random
+import string
+import sys
+import time
+from urllib.parse import parse_qs, urlparse
+import websockets
+
+TAIL_PATH = "/loki/api/v1/tail"
+
+
+class TailStub:
+
+    def __init__(self, streams=10, line_size=200, rate=1000, burst=100, total=None):
+        self._streams = [{"app": "loki-stub", "pod": f"pod-{index}", "stream": "stdout"} for index in range(streams)]
+        self._line = "".join(random.choices(string.ascii_letters + string.digits + " ", k=line_size))
+        self._rate = rate
+        self._burst = burst
+        self._total = total
+        self.connections = 0
+        self.sent = 0
+
+    def frame(self, count):
+        ts = str(time.time_ns())
+        values = {}
+        for index in range(count):
+            # Entries of a stream share the timestamp, the sequence number keeps them distinct for deduplication
+            values.setdefault(index % len(self._streams), []).append([ts, f"{self.sent + index} {self._line}"])
+        return json.dumps({"streams": [{"stream": self._streams[index], "values": stream_values}
+                                       for index, stream_values in values.items()]})
+
+    async def handle(self, ws):
+        request = urlparse(ws.request.path)
+        if request.path != TAIL_PATH or "query" not in parse_qs(request.query):
+            await ws.close(code=1008, reason="Expected a tail request with a query")
+            return
+
+        self.connections += 1
+        interval = self._burst / self._rate if self._rate else 0
+        next_send = time.monotonic()
+        sent = 0
+        while self._total is None or sent < self._total:
+            count = self._burst if self._total is None else min(self._burst, self._total - sent)
+            await ws.send(self.frame(count))
+            sent += count
+            self.sent += count
+            next_send += interval
+            await asyncio.sleep(max(0.0, next_send - time.monotonic()))
+        await ws.close()
+
+    async def serve(self, host, port):
+        async with websockets.serve(self.handle, host, port, compression=None, max_size=None):
+            print(f"Serving loki tail stub on ws://{host}:{port}{TAIL_PATH}", file=sys.stderr, flush=True)
+            await asyncio.Future()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-in for the loki tail websocket endpoint')
+    parser.add_argument("--host", default="localhost", help="Host to listen on")
+    parser.add_argument("--port", type=int, default=3100, help="Port to listen on")
+    parser.add_argument("--streams", type=int, default=10, help="Number of distinct label sets")
+    parser.add_argument("--line-size", type=int, default=200, help="Length of each log line in characters")
+    parser.add_argument("--rate", type=float, default=1000, help="Entries per second per connection, 0 for unlimited")
+    parser.add_argument("--burst", type=int, default=100, help="Entries per websocket frame")
+    parser.add_argument("--total", type=int, help="Close the connection after this many entries")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    stub = TailStub(args.streams, args.line_size, args.rate, args.burst, args.total)
+    try:
+        asyncio.run(stub.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import json
+import signal
+import sys
+import time
+from urllib.parse import urlencode
+import websockets
+import yaml
+from websocket_client import RESUME_LIMIT, JsonLinesWriter, TailDecoder
+
+
+class OutputGuard:
+    # Shared by all tails. The first failed write, e.g. to a closed stdout, stops all tails instead of failing every
+    # following message, like the failure handling of TailConsumer in websocket_client.py
+
+    def __init__(self, writer, on_failure=None):
+        self._writer = writer
+        self.failure = None
+        self.on_failure = on_failure
+
+    def write_stream(self, labels, labels_key, values, query=None):
+        if self.failure:
+            return
+        try:
+            self._writer.write_stream(labels, labels_key, values, query)
+        except OSError as e:
+            self._fail(e)
+
+    def flush(self):
+        if self.failure:
+            return
+        try:
+            self._writer.flush()
+        except OSError as e:
+            self._fail(e)
+
+    def _fail(self, error):
+        self.failure = error
+        print(f"Could not write output, stopping: {error!r}", file=sys.stderr)
+        if self.on_failure:
+            self.on_failure()
+
+
+class QueryTail:
+
+    def __init__(self, name, query, writer, base_url, proxy=None, limit=None, dedup_size=10000,
+                 initial_backoff=1.0, max_backoff=60.0, resume_overlap=30, resume_limit=RESUME_LIMIT):
+        self.name = name
+        self.query = query
+        self._base_url = base_url
+        self._proxy = proxy
+        self._limit = limit
+        self._resume_limit = resume_limit
+        self._decoder = TailDecoder(writer, dedup_size, query=name, resume_overlap=resume_overlap)
+        self._initial_backoff = initial_backoff
+        self._max_backoff = max_backoff
+        self.messages = 0
+        self.bytes = 0
+        self.errors = 0
+        self.reconnects = 0
+
+    @property
+    def decoder(self):
+        return self._decoder
+
+    @property
+    def last_timestamp(self):
+        return self._decoder.last_timestamp
+
+    @property
+    def entries(self):
+        return self._decoder.entries
+
+    def tail_url(self):
+        params = {"query": self.query}
+        start = self._decoder.resume_timestamp()
+        if start:
+            params["start"] = start
+            params["limit"] = max(self._limit or 0, self._resume_limit)
+            self._decoder.expect_backfill(params["limit"])
+        elif self._limit:
+            params["limit"] = self._limit
+        return f"{self._base_url}/loki/api/v1/tail?{urlencode(params)}"
+
+    def lag(self):
+        if self.last_timestamp is None:
+            return None
+        return round(time.time() - self.last_timestamp / 1e9, 3)
+
+    def process(self, message):
+        self.messages += 1
+        self.bytes += len(message)
+        try:
+            self._decoder.decode(message)
+        except Exception as e:
+            self.errors += 1
+            print(f"{self.name}: could not process message {message!s:200.200}: {e!r}", file=sys.stderr)
+
+    async def run(self):
+        backoff = self._initial_backoff
+        while True:
+            url = self.tail_url()
+            try:
+                async with websockets.connect(url, proxy=self._proxy, max_size=None) as ws:
+                    print(f"{self.name}: connected to {url}", file=sys.stderr)
+                    backoff = self._initial_backoff
+                    async for message in ws:
+                        self.process(message)
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                print(f"{self.name}: {e}", file=sys.stderr)
+            except Exception as e:
+                # Anything else, e.g. an invalid url or proxy, must not end the tail of this query silently
+                self.errors += 1
+                print(f"{self.name}: unexpected error: {e!r}", file=sys.stderr)
+            print(f"{self.name}: connection closed, reconnecting in {backoff}s", file=sys.stderr)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self._max_backoff)
+            self.reconnects += 1
+
+
+class TailStats:
+
+    def __init__(self, tails):
+        self._tails = tails
+        self._last_entries = {tail.name: 0 for tail in tails}
+        self._last_time = time.monotonic()
+
+    def snapshot(self):
+        now = time.monotonic()
+        elapsed = max(now - self._last_time, 1e-9)
+        stats = {}
+        for tail in self._tails:
+            entries_per_second = (tail.entries - self._last_entries[tail.name]) / elapsed
+            stats[tail.name] = {"entries": tail.entries, "messages": tail.messages, "bytes": tail.bytes,
+                                "entries_per_second": round(entries_per_second, 1), "lag_seconds": tail.lag(),
+                                "duplicates": tail.decoder.duplicates,
+                                "server_dropped_entries": tail.decoder.server_dropped_entries,
+                                "gaps": tail.decoder.gaps,
+                                "errors": tail.errors, "reconnects": tail.reconnects}
+            self._last_entries[tail.name] = tail.entries
+        self._last_time = now
+        return stats
+
+
+async def flush_periodically(writer, stats, flush_interval, stats_interval):
+    next_stats = time.monotonic() + stats_interval
+    while True:
+        await asyncio.sleep(flush_interval)
+        writer.flush()
+        if stats_interval and time.monotonic() >= next_stats:
+            print(json.dumps(stats.snapshot()), file=sys.stderr)
+            next_stats = time.monotonic() + stats_interval
+
+
+def load_config(config_file):
+    with open(config_file, 'r') as config_yaml:
+        config = yaml.load(config_yaml, Loader=yaml.FullLoader)
+    names = [query["name"] for query in config["queries"]]
+    duplicate_names = {name for name in names if names.count(name) > 1}
+    if duplicate_names:
+        raise ValueError(f"Query names must be unique: {sorted(duplicate_names)}")
+    return config
+
+
+async def tail_queries(config, buffer_size, flush_interval, stats_interval):
+    stopped = asyncio.Event()
+    writer = OutputGuard(JsonLinesWriter(buffer_size=buffer_size), on_failure=stopped.set)
+    tails = [QueryTail(query["name"], query["query"], writer, config.get("base_url", "ws://localhost:3100"),
+                       proxy=config.get("proxy"), limit=config.get("limit"),
+                       dedup_size=config.get("dedup_size", 10000), max_backoff=config.get("max_backoff", 60.0),
+                       resume_overlap=config.get("resume_overlap", 30),
+                       resume_limit=config.get("resume_limit", RESUME_LIMIT))
+             for query in config["queries"]]
+    stats = TailStats(tails)
+
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, stopped.set)
+    loop.add_signal_handler(signal.SIGTERM, stopped.set)
+
+    tasks = [asyncio.create_task(tail.run(), name=tail.name) for tail in tails]
+    tasks.append(asyncio.create_task(flush_periodically(writer, stats, flush_interval, stats_interval)))
+    await stopped.wait()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    writer.flush()
+    print(json.dumps(stats.snapshot()), file=sys.stderr)
+    return writer.failure is None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Tail many loki queries concurrently and write tagged JSON lines')
+    parser.add_argument("--config", required=True,
+                        help="YAML file with base_url, proxy (e.g. socks5://localhost:1337) and a list of queries "
+                             "with name and query")
+    parser.add_argument("--buffer-size", type=int, default=1024 * 1024, help="Size of the output buffer in bytes")
+    parser.add_argument("--flush-interval", type=float, default=0.5, help="Flush the output every n seconds")
+    parser.add_argument("--stats-interval", type=float, default=10,
+                        help="Print per query counters to stderr every n seconds, 0 to disable")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not asyncio.run(tail_queries(load_config(args.config), args.buffer_size, args.flush_interval,
+                                    args.stats_interval)):
+        exit(1)
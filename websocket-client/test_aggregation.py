@@ -0,0 +1,61 @@
+import io
+import unittest
+from aggregation import OTHER_GROUP, GroupedCounter, WindowAggregator, WindowedCounter
+
+SECOND = 1_000_000_000
+
+
+class WindowedCounterTest(unittest.TestCase):
+
+    def test_total_only_counts_buckets_inside_window(self):
+        counter = WindowedCounter(3)
+        counter.add(1)
+        counter.add(2, 2)
+        counter.add(3, 3)
+        counter.add(4, 4)
+        self.assertEqual(counter.total(4), 9)
+
+    def test_entries_older_than_window_are_ignored(self):
+        counter = WindowedCounter(2)
+        counter.add(5)
+        counter.add(3)
+        self.assertEqual(counter.total(5), 1)
+
+
+class GroupedCounterTest(unittest.TestCase):
+
+    def test_groups_above_limit_are_counted_as_other(self):
+        counter = GroupedCounter(1, max_groups=1)
+        counter.add("a", 0)
+        counter.add("b", 0)
+        counter.add("c", 0)
+        self.assertEqual(counter.totals(0), {"a": 1, OTHER_GROUP: 2})
+
+    def test_idle_groups_are_evicted_before_counting_as_other(self):
+        counter = GroupedCounter(2, max_groups=2)
+        counter.add("a", 0)
+        counter.add("b", 2)
+        counter.add("c", 2)
+        counter.add("d", 2)
+        self.assertEqual(counter.totals(2), {"b": 1, "c": 1, OTHER_GROUP: 1})
+
+
+class WindowAggregatorTest(unittest.TestCase):
+
+    def test_summary_contains_rates_and_top_groups(self):
+        aggregator = WindowAggregator(io.BytesIO(), window_seconds=10, bucket_seconds=5, group_by="pod",
+                                      patterns={"errors": "ERROR"}, top=1)
+        aggregator.write_stream({"pod": "a"}, "", [[str(1 * SECOND), "ERROR x"], [str(2 * SECOND), "ok"]])
+        aggregator.write_stream({"pod": "b"}, "", [[str(6 * SECOND), "ERROR y"]])
+        summary = aggregator.summary()
+        self.assertEqual(summary["total"], 3)
+        self.assertEqual(summary["rate"], 0.3)
+        self.assertEqual(summary["top"], [["a", 2]])
+        self.assertEqual(summary["matches"]["errors"]["total"], 2)
+
+    def test_summaries_are_emitted_while_writing(self):
+        output = io.BytesIO()
+        aggregator = WindowAggregator(output, window_seconds=10, bucket_seconds=5, emit_interval=0)
+        aggregator.write_stream({"pod": "a"}, "a", [[str(1 * SECOND), "x"]])
+        aggregator.write_stream({"pod": "a"}, "a", [[str(2 * SECOND), "x"]])
+        self.assertEqual(len(output.getvalue().splitlines()), 2)
@@ -0,0 +1,39 @@
+import json
+import unittest
+from multi_tail import OutputGuard, QueryTail
+
+
+class FailingWriter:
+
+    def __init__(self):
+        self.writes = 0
+
+    def write_stream(self, labels, labels_key, values, query=None):
+        self.writes += 1
+        raise BrokenPipeError()
+
+    def flush(self):
+        raise BrokenPipeError()
+
+
+class OutputGuardTest(unittest.TestCase):
+
+    def test_first_failed_write_stops_all_tails(self):
+        failures = []
+        writer = FailingWriter()
+        guard = OutputGuard(writer, on_failure=lambda: failures.append(guard.failure))
+        tail = QueryTail("a", '{app="a"}', guard, "ws://localhost:3100")
+        for ts in range(3):
+            tail.process(json.dumps({"streams": [{"stream": {"pod": "a"}, "values": [[str(ts), "line"]]}]}))
+        guard.flush()
+        self.assertEqual(writer.writes, 1)
+        self.assertEqual(len(failures), 1)
+        self.assertIsInstance(guard.failure, BrokenPipeError)
+        self.assertEqual(tail.errors, 0)
+
+    def test_failed_flush_stops_all_tails(self):
+        failures = []
+        guard = OutputGuard(FailingWriter(), on_failure=lambda: failures.append(True))
+        guard.flush()
+        guard.flush()
+        self.assertEqual(failures, [True])
@@ -0,0 +1,61 @@
+import contextlib
+import io
+import json
+import unittest
+from websocket_client import JsonLinesWriter, TailDecoder, parse_args
+
+SECOND = 1_000_000_000
+
+
+def message(*streams):
+    return json.dumps({"streams": [{"stream": {"pod": pod}, "values": [[str(ts), f"{pod} {ts}"] for ts in timestamps]}
+                                   for pod, timestamps in streams]})
+
+
+class FailingWriter:
+
+    def write_stream(self, labels, labels_key, values, query=None):
+        raise BrokenPipeError()
+
+
+class TailDecoderTest(unittest.TestCase):
+
+    def test_resume_at_oldest_last_entry_of_active_streams(self):
+        decoder = TailDecoder(JsonLinesWriter(io.BytesIO()), resume_overlap=10)
+        decoder.decode(message(("idle", [1 * SECOND]), ("lagging", [95 * SECOND]), ("busy", [100 * SECOND])))
+        self.assertEqual(decoder.last_timestamp, 100 * SECOND)
+        self.assertEqual(decoder.resume_timestamp(), 95 * SECOND)
+
+    def test_failed_write_does_not_advance_resume_timestamp(self):
+        decoder = TailDecoder(FailingWriter())
+        self.assertRaises(BrokenPipeError, decoder.decode, message(("a", [1 * SECOND])))
+        self.assertIsNone(decoder.last_timestamp)
+        self.assertIsNone(decoder.resume_timestamp())
+
+    def test_full_backfill_is_reported_as_gap(self):
+        decoder = TailDecoder(JsonLinesWriter(io.BytesIO()))
+        decoder.decode(message(("a", [1])))
+        decoder.expect_backfill(2)
+        decoder.decode(message(("a", [1, 2, 3])))
+        decoder.decode(message(("a", [4, 5, 6])))
+        self.assertEqual(decoder.gaps, 1)
+        self.assertEqual(decoder.duplicates, 1)
+
+
+class ParseArgsTest(unittest.TestCase):
+
+    def assertInvalid(self, argv):
+        with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit) as context:
+            parse_args(argv)
+        self.assertEqual(context.exception.code, 2)
+
+    def test_match_patterns(self):
+        self.assertEqual(parse_args(["--match", "error=level=(error|fatal)"]).match, [("error", "level=(error|fatal)")])
+        self.assertInvalid(["--match", "error"])
+        self.assertInvalid(["--match", "=error"])
+        self.assertInvalid(["--match", "error=("])
+
+    def test_window_must_be_a_multiple_of_the_bucket(self):
+        self.assertEqual(parse_args(["--window", "30", "--bucket", "10"]).window, 30)
+        self.assertInvalid(["--window", "60", "--bucket", "7"])
+        self.assertInvalid(["--bucket", "0"])
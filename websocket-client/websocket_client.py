@@ -1,24 +1,397 @@
+import argparse
 import json
-import rel
+import queue
+import re
+import sys
+import threading
+import time
+from collections import deque
+from urllib.parse import urlencode
 import websocket
+from aggregation import WindowAggregator
 
+_STOP = object()
+# Default max_entries_limit_per_query of loki, the most a tail backfills after a reconnect
+RESUME_LIMIT = 5000
 
-def on_message(ws, message):
-    for stream in json.loads(message)["streams"]:
-        print(json.dumps(stream, indent=4))
 
+class JsonLinesWriter:
 
-def on_error(ws, error):
-    print(error)
+    def __init__(self, output=None, buffer_size=1024 * 1024):
+        if output is None:
+            output = open(sys.stdout.fileno(), "wb", buffering=buffer_size, closefd=False)
+        self._output = output
+        self.entries = 0
 
+    def write_stream(self, labels, labels_key, values, query=None):
+        prefix = '{"stream":' + labels_key + ',"ts":"'
+        if query is not None:
+            prefix = '{"query":' + json.dumps(query) + "," + prefix[1:]
+        self._output.write("".join([f'{prefix}{ts}","line":{json.dumps(line)}}}\n'
+                                    for ts, line in values]).encode())
+        self.entries += len(values)
 
-if __name__ == "__main__":
-    header = {'Sec-WebSocket-Key: dGVzdC13ZWJzb2NrZXQK', 'Sec-WebSocket-Version: 13',
-              'Sec-WebSocket-Extensions: permessage-deflate', 'Connection: keep-alive, Upgrade', 'Upgrade: websocket'}
+    def flush(self):
+        self._output.flush()
+
+
+class StreamDeduplicator:
+
+    def __init__(self, max_size=10000):
+        self._max_size = max_size
+        self._seen = set()
+        self._order = deque()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def is_duplicate(self, labels_key, ts, line):
+        key = (labels_key, ts, hash(line))
+        if key in self._seen:
+            return True
+        self._seen.add(key)
+        self._order.append(key)
+        if len(self._order) > self._max_size:
+            self._seen.discard(self._order.popleft())
+        return False
+
+
+class TailDecoder:
+
+    def __init__(self, sink, dedup_size=10000, query=None, resume_overlap=30):
+        self._sink = sink
+        self._deduplicator = StreamDeduplicator(dedup_size)
+        self._query = query
+        self._resume_overlap_ns = int(resume_overlap * 1e9)
+        self._stream_timestamps = {}
+        self._backfill_limit = None
+        self.entries = 0
+        self.duplicates = 0
+        self.server_dropped_entries = 0
+        self.gaps = 0
+        self.last_timestamp = None
+
+    def resume_timestamp(self):
+        # Oldest last written entry of the streams active within the overlap. Resuming there re-sends entries of
+        # the other streams, which the deduplicator drops, instead of skipping entries of streams lagging behind
+        if self.last_timestamp is None:
+            return None
+        horizon = self.last_timestamp - self._resume_overlap_ns
+        self._stream_timestamps = {labels_key: ts for labels_key, ts in self._stream_timestamps.items()
+                                   if ts >= horizon}
+        return min(self._stream_timestamps.values())
+
+    def expect_backfill(self, limit):
+        self._backfill_limit = limit
+
+    def decode(self, message):
+        tail_response = json.loads(message)
+        self.server_dropped_entries += len(tail_response.get("dropped_entries") or ())
+        if self._backfill_limit:
+            # The first response after connecting is the backfill, a full one means older entries were cut off
+            backfilled = sum(len(stream.get("values") or ()) for stream in tail_response.get("streams") or ())
+            if backfilled >= self._backfill_limit:
+                self.gaps += 1
+                print(f"Backfill after reconnect reached the limit of {self._backfill_limit} entries, "
+                      f"entries before {self.resume_timestamp()} may be missing", file=sys.stderr)
+            self._backfill_limit = None
+        for stream in tail_response.get("streams") or ():
+            values = stream.get("values")
+            if not values:
+                continue
+            labels = stream.get("stream") or {}
+            labels_key = json.dumps(labels, separators=(",", ":"), sort_keys=True)
+            new_values = [value for value in values if not self._deduplicator.is_duplicate(labels_key, *value)]
+            self.duplicates += len(values) - len(new_values)
+            if new_values:
+                self._sink.write_stream(labels, labels_key, new_values, self._query)
+                self.entries += len(new_values)
+                # Only written entries count for resuming
+                newest = max(int(ts) for ts, _ in new_values)
+                if newest > self._stream_timestamps.get(labels_key, 0):
+                    self._stream_timestamps[labels_key] = newest
+                if self.last_timestamp is None or newest > self.last_timestamp:
+                    self.last_timestamp = newest
+
+
+class TailConsumer:
+
+    def __init__(self, sink, queue_size=10000, drop_when_full=False, stats_interval=0, dedup_size=10000,
+                 resume_overlap=30):
+        self._sink = sink
+        self._decoder = TailDecoder(sink, dedup_size, resume_overlap=resume_overlap)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._drop_when_full = drop_when_full
+        self._stats_interval = stats_interval
+        self._thread = threading.Thread(target=self._run, name="tail-writer", daemon=True)
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.errors = 0
+        # Set when writing the output failed, e.g. a closed pipe. Messages are dropped from then on and
+        # on_failure, if given, is called from the writer thread to stop the tail
+        self.failure = None
+        self.on_failure = None
+
+    @property
+    def last_timestamp(self):
+        return self._decoder.last_timestamp
+
+    def resume_timestamp(self):
+        return self._decoder.resume_timestamp()
+
+    def expect_backfill(self, limit):
+        self._decoder.expect_backfill(limit)
+
+    def on_message(self, ws, message):
+        self.received += 1
+        if self.failure:
+            self.dropped += 1
+            return
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            if self._drop_when_full:
+                self.dropped += 1
+                return
+            self.blocked += 1
+            self._queue.put(message)
+
+    def on_error(self, ws, error):
+        print(error, file=sys.stderr)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def wait_until_drained(self):
+        self._queue.join()
+
+    def stats(self):
+        return {"received": self.received, "processed": self.processed, "dropped": self.dropped,
+                "blocked": self.blocked, "queued": self._queue.qsize(),
+                "entries": self._decoder.entries, "duplicates": self._decoder.duplicates,
+                "server_dropped_entries": self._decoder.server_dropped_entries, "errors": self.errors,
+                "gaps": self._decoder.gaps, "last_timestamp": self.last_timestamp}
+
+    def process(self, message):
+        self._decoder.decode(message)
+        self.processed += 1
+
+    def _fail(self, error):
+        self.failure = error
+        print(f"Could not write output, stopping: {error!r}", file=sys.stderr)
+        if self.on_failure:
+            self.on_failure()
 
-    ws = websocket.WebSocketApp('ws://localhost:3100/loki/api/v1/tail?query={cluster="wlan-1.refsa1.bn"}',
-                                on_message=on_message, on_error=on_error, header=header)
+    def _flush(self):
+        try:
+            self._sink.flush()
+        except OSError as e:
+            self._fail(e)
 
-    ws.run_forever(dispatcher=rel, http_proxy_host="localhost", http_proxy_port=1337, proxy_type="socks5")
-    rel.signal(2, rel.abort)  # Keyboard Interrupt
-    rel.dispatch()
+    def _run(self):
+        next_stats = time.monotonic() + self._stats_interval
+        while True:
+            try:
+                message = self._queue.get(timeout=1)
+            except queue.Empty:
+                message = None
+            if message is _STOP:
+                break
+            if message is not None:
+                try:
+                    if self.failure:
+                        # Keep taking messages so that a socket thread blocked in put() gets released
+                        self.dropped += 1
+                    else:
+                        self.process(message)
+                except OSError as e:
+                    self.errors += 1
+                    self._fail(e)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"Could not process message {message!s:200.200}: {e!r}", file=sys.stderr)
+                finally:
+                    self._queue.task_done()
+            if self._queue.empty() and not self.failure:
+                self._flush()
+            if self._stats_interval and time.monotonic() >= next_stats:
+                print(json.dumps(self.stats()), file=sys.stderr)
+                next_stats = time.monotonic() + self._stats_interval
+        if not self.failure:
+            self._flush()
+
+
+class LokiTail:
+
+    def __init__(self, consumer, base_url, query, start=None, limit=None, proxy=None,
+                 initial_backoff=1.0, max_backoff=60.0, resume_limit=RESUME_LIMIT):
+        self._consumer = consumer
+        self._base_url = base_url
+        self._query = query
+        self._start = start
+        self._limit = limit
+        self._resume_limit = resume_limit
+        self._proxy = proxy or {}
+        self._initial_backoff = initial_backoff
+        self._max_backoff = max_backoff
+        self._backoff = initial_backoff
+        self._stopped = False
+        self._ws = None
+        self.reconnects = 0
+
+    def tail_url(self):
+        params = {"query": self._query}
+        start, limit = self._consumer.resume_timestamp(), max(self._limit or 0, self._resume_limit)
+        if start:
+            # Loki backfills only limit entries, 100 by default, a longer outage would lose entries silently
+            self._consumer.expect_backfill(limit)
+        else:
+            start, limit = self._start, self._limit
+        if start:
+            params["start"] = start
+        if limit:
+            params["limit"] = limit
+        return f"{self._base_url}/loki/api/v1/tail?{urlencode(params)}"
+
+    def on_open(self, ws):
+        self._backoff = self._initial_backoff
+
+    def on_error(self, ws, error):
+        if isinstance(error, KeyboardInterrupt):
+            self._stopped = True
+        else:
+            self._consumer.on_error(ws, error)
+
+    def stop(self, *args):
+        self._stopped = True
+        if self._ws:
+            self._ws.close()
+
+    def run(self):
+        while not self._stopped:
+            url = self.tail_url()
+            print(f"Connecting to {url}", file=sys.stderr)
+            self._ws = websocket.WebSocketApp(url, on_open=self.on_open,
+                                              on_message=self._consumer.on_message, on_error=self.on_error)
+            # json.loads rejects invalid UTF-8 anyway, the pure python validation of websocket-client
+            # would otherwise cost more than decoding and writing the frame
+            self._ws.run_forever(ping_interval=30, ping_timeout=10, skip_utf8_validation=True, **self._proxy)
+            if self._stopped:
+                break
+            self._consumer.wait_until_drained()
+            print(f"Connection closed, reconnecting in {self._backoff}s", file=sys.stderr)
+            time.sleep(self._backoff)
+            self._backoff = min(self._backoff * 2, self._max_backoff)
+            self.reconnects += 1
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def match_pattern(value):
+    name, separator, pattern = value.partition("=")
+    if not separator or not name:
+        raise argparse.ArgumentTypeError(f"{value} is not of the form name=regex")
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        raise argparse.ArgumentTypeError(f"Invalid regex {pattern}: {e}")
+    return name, pattern
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Tail a loki query and write the entries as JSON lines')
+    parser.add_argument("--base-url", default="ws://localhost:3100", help="The websocket url of loki")
+    parser.add_argument("--query", default='{cluster="wlan-1.refsa1.bn"}', help="The LogQL query to tail")
+    parser.add_argument("--start", type=int, help="Start of the tail as nanosecond timestamp")
+    parser.add_argument("--limit", type=int, help="Maximum number of entries returned when (re)connecting")
+    parser.add_argument("--proxy-host", default="localhost", help="Host of the SOCKS proxy, empty for no proxy")
+    parser.add_argument("--proxy-port", type=int, default=1337, help="Port of the SOCKS proxy")
+    parser.add_argument("--proxy-type", default="socks5", help="Type of the proxy")
+    parser.add_argument("--max-backoff", type=float, default=60.0, help="Maximum delay between reconnects in seconds")
+    parser.add_argument("--dedup-size", type=int, default=10000,
+                        help="Number of recent entries remembered to drop duplicates after a reconnect. Should "
+                             "cover the entries of --resume-overlap")
+    parser.add_argument("--resume-overlap", type=float, default=30,
+                        help="A reconnect resumes at the oldest last entry of the streams active within this many "
+                             "seconds of the newest entry")
+    parser.add_argument("--resume-limit", type=int, default=RESUME_LIMIT,
+                        help="Maximum number of entries backfilled after a reconnect, a full backfill is reported "
+                             "as a possible gap")
+    parser.add_argument("--aggregate", action="store_true",
+                        help="Emit periodic windowed summaries instead of every entry")
+    parser.add_argument("--window", type=positive_int, default=60, help="Length of the aggregation window in seconds")
+    parser.add_argument("--bucket", type=positive_int, default=10,
+                        help="Length of a window bucket in seconds, equal to --window for tumbling windows")
+    parser.add_argument("--group-by", help="Label to group counts by, e.g. pod. Defaults to the full label set")
+    parser.add_argument("--match", action="append", default=[], type=match_pattern,
+                        help="Count lines matching a regex per group, given as name=regex. Can be repeated")
+    parser.add_argument("--top", type=int, default=10, help="Number of groups reported per summary")
+    parser.add_argument("--emit-interval", type=float, default=10, help="Emit a summary every n seconds")
+    parser.add_argument("--max-groups", type=int, default=1000,
+                        help="Maximum number of tracked groups, further groups are counted as __other__")
+    parser.add_argument("--queue-size", type=int, default=10000,
+                        help="Maximum number of messages buffered between the socket and the writer")
+    parser.add_argument("--drop-when-full", action="store_true",
+                        help="Drop messages instead of blocking the socket when the queue is full")
+    parser.add_argument("--buffer-size", type=int, default=1024 * 1024, help="Size of the output buffer in bytes")
+    parser.add_argument("--stats-interval", type=float, default=0,
+                        help="Print consumer counters to stderr every n seconds")
+    args = parser.parse_args(argv)
+    if args.window % args.bucket:
+        parser.error(f"--window {args.window} must be a multiple of --bucket {args.bucket}")
+    return args
+
+
+def proxy_options(arguments):
+    if not arguments.proxy_host:
+        return {}
+    return {"http_proxy_host": arguments.proxy_host, "http_proxy_port": arguments.proxy_port,
+            "proxy_type": arguments.proxy_type}
+
+
+def create_sink(arguments):
+    if not arguments.aggregate:
+        return JsonLinesWriter(buffer_size=arguments.buffer_size)
+    patterns = dict(arguments.match)
+    return WindowAggregator(window_seconds=arguments.window, bucket_seconds=arguments.bucket,
+                            group_by=arguments.group_by, patterns=patterns, top=arguments.top,
+                            emit_interval=arguments.emit_interval, max_groups=arguments.max_groups)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    sink = create_sink(args)
+    consumer = TailConsumer(sink, args.queue_size, args.drop_when_full, args.stats_interval, args.dedup_size,
+                            args.resume_overlap)
+    consumer.start()
+
+    tail = LokiTail(consumer, args.base_url, args.query, args.start, args.limit, proxy_options(args),
+                    max_backoff=args.max_backoff, resume_limit=args.resume_limit)
+    consumer.on_failure = tail.stop
+    try:
+        tail.run()
+    except KeyboardInterrupt:
+        tail.stop()
+
+    consumer.stop()
+    if args.aggregate and not consumer.failure:
+        sink.emit()
+    print(json.dumps({**consumer.stats(), "reconnects": tail.reconnects}), file=sys.stderr)
+    if consumer.failure:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import json
+import logging
+import sqlite3
+import sys
+import zlib
+from datetime import datetime, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    component_id TEXT NOT NULL,
+    component_name TEXT NOT NULL,
+    scanned_at TEXT NOT NULL,
+    report BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS findings (
+    report_id INTEGER NOT NULL REFERENCES reports(id),
+    component_id TEXT NOT NULL,
+    component_name TEXT NOT NULL,
+    scanned_at TEXT NOT NULL,
+    cve TEXT,
+    issue_id TEXT,
+    severity TEXT,
+    vulnerable_component TEXT
+);
+CREATE INDEX IF NOT EXISTS reports_by_component ON reports (component_id, scanned_at);
+CREATE INDEX IF NOT EXISTS reports_by_name ON reports (component_name, scanned_at);
+CREATE INDEX IF NOT EXISTS findings_by_cve ON findings (cve, scanned_at);
+CREATE INDEX IF NOT EXISTS findings_by_component ON findings (component_id, cve);
+CREATE INDEX IF NOT EXISTS findings_by_name ON findings (component_name, cve);
+CREATE INDEX IF NOT EXISTS findings_by_report ON findings (report_id);
+"""
+
+
+def component_name(component_id):
+    # docker://repo/app:1.4.2 -> docker://repo/app, so that queries can span all versions of a component
+    last_colon_idx = component_id.rfind(":")
+    return component_id[:last_colon_idx] if last_colon_idx > component_id.find("//") else component_id
+
+
+def report_findings(report):
+    for row in report.get("rows") or []:
+        cves = [cve.get("cve") for cve in row.get("cves") or [] if cve.get("cve")] or [None]
+        for cve in cves:
+            yield cve, row.get("issue_id"), row.get("severity"), row.get("vulnerable_component")
+
+
+class ReportArchive:
+
+    def __init__(self, path):
+        # Several pipelines may append to the same archive, wait for their write locks instead of failing
+        self._connection = sqlite3.connect(path, timeout=30)
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def add(self, component_id, report, scanned_at=None):
+        scanned_at = scanned_at or datetime.now(timezone.utc).isoformat(timespec="seconds")
+        name = component_name(component_id)
+        data = zlib.compress(json.dumps(report, separators=(",", ":")).encode(), 9)
+        with self._connection:
+            report_id = self._connection.execute(
+                "INSERT INTO reports (component_id, component_name, scanned_at, report) VALUES (?, ?, ?, ?)",
+                (component_id, name, scanned_at, data)).lastrowid
+            self._connection.executemany(
+                "INSERT INTO findings (report_id, component_id, component_name, scanned_at, cve, issue_id, severity, "
+                "vulnerable_component) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(report_id, component_id, name, scanned_at, *finding) for finding in report_findings(report)])
+        return report_id
+
+    def get(self, report_id):
+        row = self._connection.execute("SELECT report FROM reports WHERE id = ?", (report_id,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def first_seen(self, cve, component=None):
+        # component matches either a full component id or a component name without version
+        query = "SELECT component_id, MIN(scanned_at), MAX(scanned_at), COUNT(DISTINCT report_id) FROM findings " \
+                "WHERE cve = ?"
+        parameters = [cve]
+        if component:
+            query += " AND (component_id = ? OR component_name = ?)"
+            parameters += [component, component]
+        query += " GROUP BY component_id ORDER BY MIN(scanned_at)"
+        return [{"component_id": component_id, "first_seen": first, "last_seen": last, "reports": reports}
+                for component_id, first, last, reports in self._connection.execute(query, parameters)]
+
+    def trend(self, component=None, cve=None):
+        query = "SELECT r.id, r.component_id, r.scanned_at, COUNT(f.report_id), COUNT(DISTINCT f.cve) " \
+                "FROM reports r LEFT JOIN findings f ON f.report_id = r.id"
+        conditions, parameters = [], []
+        if component:
+            conditions.append("(r.component_id = ? OR r.component_name = ?)")
+            parameters += [component, component]
+        if cve:
+            conditions.append("r.id IN (SELECT report_id FROM findings WHERE cve = ?)")
+            parameters.append(cve)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " GROUP BY r.id ORDER BY r.scanned_at"
+        return [{"report_id": report_id, "component_id": component_id, "scanned_at": scanned_at,
+                 "findings": findings, "cves": cves}
+                for report_id, component_id, scanned_at, findings, cves in self._connection.execute(query, parameters)]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Query the archive of xray reports written by scan.py')
+    parser.add_argument("--archive", required=True, help="The sqlite archive file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    first_seen = commands.add_parser("first-seen", help="When a CVE first and last appeared, per component")
+    first_seen.add_argument("cve")
+    first_seen.add_argument("--component", help="Component id or component id without version")
+    trend = commands.add_parser("trend", help="Number of findings of every archived report")
+    trend.add_argument("--component", help="Component id or component id without version")
+    trend.add_argument("--cve", help="Only reports containing this CVE")
+    show = commands.add_parser("show", help="Print an archived report")
+    show.add_argument("report_id", type=int)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    archive = ReportArchive(args.archive)
+    try:
+        if args.command == "show":
+            report = archive.get(args.report_id)
+            if report is None:
+                logging.error(f"Report {args.report_id} not found in {args.archive}")
+                exit(1)
+            json.dump(report, sys.stdout, indent=4, sort_keys=True)
+            print()
+            return
+        results = archive.first_seen(args.cve, args.component) if args.command == "first-seen" \
+            else archive.trend(args.component, args.cve)
+        for result in results:
+            print(json.dumps(result))
+    finally:
+        archive.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,32 @@
 import argparse
 from datetime import datetime
+import functools
 import json
 import requests
 import os
 import sys
 import logging
+import queue
 import tempfile
+import threading
+import time
 from requests.auth import HTTPBasicAuth
-from retrying import retry, RetryError
+from retrying import retry
 from pathlib import Path
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "decorator"))
+from instrumentation import instrument  # noqa: E402
+from report_archive import ReportArchive  # noqa: E402
+
+
+# Reports created by this script are named with this prefix so that sweep_reports.py can find orphaned ones
+REPORT_NAME_PREFIX = "ci-scan-"
+
 
 def get_report_file_name(target_directory, component_id):
+    # Date and microseconds keep runs within the same second and on different days from overwriting each other
     return target_directory + "/" + component_id[component_id.rindex("/") + 1:len(component_id)].replace(":", "-") \
-           + "-" + datetime.now().strftime("%H:%M:%S").replace(":", "-") + ".json"
+           + "-" + datetime.now().strftime("%Y-%m-%dT%H-%M-%S-%f") + ".json"
 
 
 def save_report(target_directory, report_as_json, component_id):
@@ -23,6 +36,15 @@ def save_report(target_directory, report_as_json, component_id):
     logging.info(f"Successfully saved report to {filename}")
 
 
+def archive_report(archive_file, report_as_json, component_id):
+    archive = ReportArchive(archive_file)
+    try:
+        report_id = archive.add(component_id, report_as_json)
+    finally:
+        archive.close()
+    logging.info(f"Successfully archived report as {report_id} in {archive_file}")
+
+
 class Artifactory:
 
     def __init__(self, base_url: str, user: str, token: str):
@@ -52,21 +74,126 @@ class Artifactory:
         return f"{self.base_url}/xray/api/v1"
 
 
+# Batch runs of several steps in one process share the session and skip the repeated ping
+@functools.lru_cache(maxsize=None)
+def connect(base_url: str, user: str, token: str) -> Artifactory:
+    return Artifactory(base_url=base_url, user=user, token=token)
+
+
+# Index status of many artifacts, fetched with bulk xray summary requests instead of one request per artifact.
+# Indexed artifacts stay indexed, other entries expire after ttl_seconds. Only the paths that are read are refreshed,
+# callers polling many artifacts refresh them together.
+class ScanStatusTable:
+
+    def __init__(self, artifactory: Artifactory, repo_key: str, ttl_seconds: float = 2, chunk_size: int = 100,
+                 artifactory_id: str = "default"):
+        self._artifactory = artifactory
+        self._repo_key = repo_key
+        # Name of the artifactory instance in xray, the first segment of the paths of the summary api
+        self._artifactory_id = artifactory_id
+        self._ttl_seconds = ttl_seconds
+        self._chunk_size = chunk_size
+        # path -> (indexed, fetched at), indexed is None while the status is unknown
+        self._statuses = {}
+        # Paths confirmed as not indexed by a per artifact request, summary errors for them mean "not indexed"
+        self._confirmed = set()
+        # Xray versions without the summary api, callers fall back to per artifact requests
+        self._unsupported = False
+
+    def register(self, paths):
+        for path in paths:
+            self._statuses.setdefault(path, (None, 0))
+
+    def invalidate(self, path):
+        self._statuses[path] = (None, 0)
+
+    # Status of an artifact determined without the summary api
+    def record(self, path, indexed):
+        self._statuses[path] = (indexed, time.monotonic())
+        if indexed is False:
+            self._confirmed.add(path)
+
+    def is_indexed(self, path):
+        if self._unsupported:
+            return None
+        self.refresh([path])
+        indexed, _ = self._statuses[path]
+        return indexed
+
+    def refresh(self, paths=None):
+        paths = None if paths is None else list(paths)
+        self.register(paths or [])
+        now = time.monotonic()
+        stale = [path for path in (self._statuses if paths is None else paths)
+                 if not self._statuses[path][0] and now - self._statuses[path][1] > self._ttl_seconds]
+        for first in range(0, len(stale), self._chunk_size):
+            if self._unsupported:
+                return
+            self._statuses.update(self.fetch(stale[first:first + self._chunk_size]))
+
+    @instrument
+    def fetch(self, paths):
+        # Artifacts listed in the summary are indexed. Errors do not tell "not indexed" apart from e.g. a wrong
+        # path or missing permissions, so their status stays unknown until it is confirmed per artifact
+        xray_paths = {f"{self._artifactory_id}/{self._repo_key}/{path}": path for path in paths}
+        response = self._artifactory.session.post(f"{self._artifactory.xray_api_url}/summary/artifact",
+                                                  json={"paths": list(xray_paths)})
+        fetched_at = time.monotonic()
+        if response.status_code != 200:
+            logging.info(f"Bulk status of {len(paths)} artifacts could not be retrieved: {response.text}")
+            self._unsupported = response.status_code in (404, 405)
+            return {path: (None, fetched_at) for path in paths}
+        summary = response.json()
+        statuses = {path: (None, fetched_at) for path in paths}
+        for error in summary.get("errors") or []:
+            path = xray_paths.get(error.get("identifier"))
+            if path in self._confirmed:
+                statuses[path] = (False, fetched_at)
+            else:
+                logging.debug(f"Xray summary of {error.get('identifier')} not available: {error.get('error')}")
+        for artifact in summary.get("artifacts") or []:
+            xray_path = artifact.get("general", {}).get("path")
+            if xray_path in xray_paths:
+                statuses[xray_paths[xray_path]] = (True, fetched_at)
+        return statuses
+
+
 class ArtifactScan:
 
-    def __init__(self, artifactory: Artifactory, component_id: str, repo_key: str):
+    def __init__(self, artifactory: Artifactory, component_id: str, repo_key: str,
+                 status_table: ScanStatusTable = None):
         self.__artifactory = artifactory
         self.__component_id = component_id
         self.__component_path = self.convert_component_id_to_path()
-        self.__report_name = self.__component_path.replace("/", "-").replace(".", "-")
+        self.__report_name = REPORT_NAME_PREFIX + self.__component_path.replace("/", "-").replace(".", "-")
         self.__repo_key = repo_key
         self.__report_id = None
+        self.__status_table = status_table
 
     @property
     def component_id(self):
         return self.__component_id
 
+    @property
+    def component_path(self):
+        return self.__component_path
+
+    @property
+    def manifest_path(self):
+        return f"{self.__component_path}/manifest.json"
+
     def is_scanned(self) -> bool:
+        indexed = self.__status_table.is_indexed(self.manifest_path) if self.__status_table else None
+        if indexed is None:
+            indexed = self.get_scan_status()
+            if self.__status_table:
+                self.__status_table.record(self.manifest_path, indexed)
+            return indexed
+        logging.info(f"Artifact {self.__component_id} has {'already' if indexed else 'not yet'} been scanned")
+        return indexed
+
+    @instrument
+    def get_scan_status(self) -> bool:
         response = self.__artifactory.session.get(f"{self.__artifactory.ui_api_url}/artifactxray?path="
                                                   f"{self.__component_path}/manifest.json&repoKey={self.__repo_key}")
         if response.status_code == 404:
@@ -85,32 +212,26 @@ class ArtifactScan:
             raise RuntimeError(f"Could not determine status of artifact  {self.__component_id}"
                                f"from response {response}")
 
-    def scan(self) -> bool:
+    @instrument
+    def start_scan(self) -> bool:
         logging.info(f"Start scanning of artifact {self.__component_id}")
-        try:
-            response = self.__artifactory.session.post(f"{self.__artifactory.xray_api_url}/scanArtifact",
-                                                       json={"componentID": f"{self.__component_id}"})
-            if response.status_code != 200:
-                logging.info(f"Scanning of artifact {self.__component_id} could not be started."
-                             f" Reason: {response.text}")
-                return False
-
-            self.wait_for_scan_to_complete()
-            return True
-        except RetryError:
-            logging.info(f"Scanning of artifact {self.__component_id} did not complete in time")
+        response = self.__artifactory.session.post(f"{self.__artifactory.xray_api_url}/scanArtifact",
+                                                   json={"componentID": f"{self.__component_id}"})
+        if self.__status_table:
+            self.__status_table.invalidate(self.manifest_path)
+        if response.status_code != 200:
+            logging.info(f"Scanning of artifact {self.__component_id} could not be started. Reason: {response.text}")
             return False
+        return True
 
-    @staticmethod
-    def retry_if_not_yet_scanned(result):
-        if not result:
-            logging.debug(f"Scan of artifact not yet complete")
-        return not result
-
-    # noinspection PyUnresolvedReferences
-    @retry(wait_fixed=3000, stop_max_attempt_number=2, retry_on_result=retry_if_not_yet_scanned.__func__)
-    def wait_for_scan_to_complete(self):
-        return self.is_scanned()
+    @instrument
+    def get_manifest_digest(self):
+        response = self.__artifactory.session.get(f"{self.__artifactory.base_url}/artifactory/api/storage/"
+                                                  f"{self.__repo_key}/{self.__component_path}/manifest.json")
+        if response.status_code != 200:
+            logging.info(f"Manifest digest of artifact {self.__component_id} could not be resolved: {response.text}")
+            return None
+        return response.json().get("checksums", {}).get("sha256")
 
     def convert_component_id_to_path(self):
         last_colon_idx = self.__component_id.rfind(":")
@@ -123,6 +244,7 @@ class ArtifactScan:
         self.wait_for_report_creation()
         return self.get_report_details()
 
+    @instrument
     def create_report(self):
         logging.info(f"Start report creation for artifact {self.__component_id}")
         request_data = {
@@ -151,6 +273,7 @@ class ArtifactScan:
         self.__report_id = response.json()["report_id"]
         return self.__report_id
 
+    @instrument(size=lambda report: len((report or {}).get("rows", ())))
     def get_report_details(self):
         response = self.__artifactory.session.post(f"{self.__artifactory.xray_api_url}/reports/vulnerabilities/"
                                                    f"{self.__report_id}?direction=desc&page_num=1&"
@@ -169,6 +292,7 @@ class ArtifactScan:
 
     # noinspection PyUnresolvedReferences
     @retry(wait_fixed=5000, stop_max_attempt_number=30, retry_on_result=retry_if_not_yet_completed.__func__)
+    @instrument
     def wait_for_report_creation(self):
         logging.info(f"Waiting for report {self.__report_id} to be completed")
         response = self.__artifactory.session.get(f"{self.__artifactory.xray_api_url}/reports/{self.__report_id}")
@@ -191,13 +315,47 @@ class ArtifactScan:
 
         return True
 
+    @instrument
     def delete_report(self):
+        if self.__report_id is None:
+            return False
         response = self.__artifactory.session.delete(f"{self.__artifactory.xray_api_url}/reports/{self.__report_id}")
         if response.status_code != 200:
             logging.error(f"Report {self.__report_id} could not be deleted: {response.text}")
             return False
         else:
             logging.debug(f"Report {self.__report_id} successfully deleted")
+            return True
+
+
+# Deletes reports on a background thread so that the gate does not wait for the deletion round trip
+class ReportCleaner:
+
+    def __init__(self, timeout_seconds: float = 30):
+        self._timeout_seconds = timeout_seconds
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="report-cleaner", daemon=True)
+        self._thread.start()
+
+    def delete_later(self, artifact_scan: ArtifactScan):
+        self._queue.put(artifact_scan)
+
+    def _run(self):
+        while True:
+            artifact_scan = self._queue.get()
+            if artifact_scan is None:
+                return
+            try:
+                artifact_scan.delete_report()
+            except Exception as e:
+                logging.error(f"Report of artifact {artifact_scan.component_id} could not be deleted: {e}")
+
+    def close(self):
+        # Waits a bounded time only, reports left behind are removed by sweep_reports.py
+        self._queue.put(None)
+        self._thread.join(self._timeout_seconds)
+        if self._thread.is_alive():
+            logging.warning(f"Report deletion did not finish within {self._timeout_seconds}s")
 
 
 class ArtifactReportAnalysis:
@@ -221,6 +379,8 @@ class ArtifactReportAnalysis:
 
 def init_logging():
     root = logging.getLogger()
+    if root.handlers:
+        return
     root.setLevel(logging.DEBUG)
     handler = logging.StreamHandler(sys.stdout)
     handler.setLevel(logging.DEBUG)
@@ -230,51 +390,162 @@ def init_logging():
 
 
 def get_script_path():
-    return os.path.dirname(os.path.realpath(sys.argv[0]))
+    return os.path.dirname(os.path.realpath(__file__))
 
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument("--user", help="The artifactory user name")
     parser.add_argument("--token", help="The api token of the user")
-    parser.add_argument("--component-id",
-                        help="The component id. E.g.: 'docker://repo/path/component:5.0.50'")
+    parser.add_argument("--component-id", action="append", required=True,
+                        help="The component id. E.g.: 'docker://repo/path/component:5.0.50'. Can be repeated, "
+                             "tags of the same image are scanned once")
     parser.add_argument("--repo-key", help="The repo-key")
+    parser.add_argument("--artifactory-id", default="default",
+                        help="Name of the artifactory instance in xray, used for bulk status requests")
     parser.add_argument("--base-url", help="The url to artifactory")
     parser.add_argument("--report-target-directory", help="The target directory to save the report to",
                         default=tempfile.gettempdir())
-    return parser.parse_args()
+    parser.add_argument("--report-archive", help="Sqlite archive the report is also appended to, "
+                                                 "see report_archive.py for queries")
+    return parser.parse_args(argv)
 
 
-def start_and_wait_for_scan(artifact_scan):
-    if not artifact_scan.is_scanned():
-        logging.info(f"Artifact {artifact_scan} has not yet been scanned. Starting scan")
-        if not artifact_scan.scan():
-            logging.error(f"Artifact {artifact_scan.component_id} could not be scanned. Aborting")
-            exit(1)
-    else:
-        logging.info(f"Artifact {artifact_scan.component_id} has already been scanned. "
-                     f"Aborting to avoid redundant report creation")
+def exit_if_already_scanned(artifact_scans):
+    # Checked for all artifacts before the first scan, so the gate does not stop halfway through the artifacts
+    already_scanned = [artifact_scan.component_id for artifact_scan in artifact_scans if artifact_scan.is_scanned()]
+    if already_scanned:
+        logging.error(f"Artifacts {already_scanned} have already been scanned. "
+                      f"Aborting to avoid redundant report creation")
         exit(1)
 
 
-def get_and_store_report(artifact_scan, report_target_directory):
+# All scans are started first and then polled together, with one bulk status request per poll
+@instrument(size=len)
+def wait_for_scans(artifact_scans, status_table, attempts=2, poll_seconds=3):
+    pending = list(artifact_scans)
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(poll_seconds)
+        status_table.refresh([artifact_scan.manifest_path for artifact_scan in pending])
+        pending = [artifact_scan for artifact_scan in pending if not artifact_scan.is_scanned()]
+        if not pending:
+            break
+        logging.debug(f"Scans of {len(pending)} artifacts not yet complete")
+    return [artifact_scan.component_id for artifact_scan in pending]
+
+
+def start_and_wait_for_scans(artifact_scans, status_table):
+    not_started = [artifact_scan.component_id for artifact_scan in artifact_scans if not artifact_scan.start_scan()]
+    if not_started:
+        logging.error(f"Scans of artifacts {not_started} could not be started. Aborting")
+        exit(1)
+    not_completed = wait_for_scans(artifact_scans, status_table)
+    if not_completed:
+        logging.error(f"Scans of artifacts {not_completed} did not complete in time. Aborting")
+        exit(1)
+
+
+def get_and_store_report(artifact_scan, report_target_directory, report_cleaner=None, report_archive=None):
     report = None
     try:
         report = artifact_scan.get_report()
     except Exception as e:
-        logging.error("An error occurred while trying to get the vulnerability report", e)
+        logging.error(f"An error occurred while trying to get the vulnerability report: {e}")
     finally:
-        artifact_scan.delete_report()
+        if report_cleaner:
+            report_cleaner.delete_later(artifact_scan)
+        else:
+            artifact_scan.delete_report()
     if not report:
         logging.error(f"Vulnerability report for artifact {artifact_scan.component_id} could not created. Aborting")
         exit(1)
     logging.info(f"Vulnerability report for artifact {artifact_scan.component_id} successfully obtained")
-    save_report(report_target_directory, report, artifact_scan.component_id)
+    store_report(report, artifact_scan.component_id, report_target_directory, report_archive)
     return report
 
 
-def analyse_report(report, component_id):
+def store_report(report, component_id, report_target_directory, report_archive=None):
+    save_report(report_target_directory, report, component_id)
+    if report_archive:
+        archive_report(report_archive, report, component_id)
+
+
+# Reports by manifest digest, shared by all tags of the same image and by later steps of a batch. Entries expire so
+# that a long batch neither keeps every report in memory nor reuses a report after the vulnerability data changed
+REPORT_CACHE_SECONDS = 600
+_reports_by_digest = {}
+
+
+def get_cached_report(digest):
+    now = time.monotonic()
+    for expired in [key for key, (_, obtained_at) in _reports_by_digest.items()
+                    if now - obtained_at > REPORT_CACHE_SECONDS]:
+        del _reports_by_digest[expired]
+    cached = _reports_by_digest.get(digest)
+    return cached[0] if cached else None
+
+
+def cache_report(digest, report):
+    _reports_by_digest[digest] = (report, time.monotonic())
+
+
+# One AQL search for the manifest digests of many artifacts instead of one storage request per artifact.
+# Returns component path -> sha256, or None if the search is not permitted
+@instrument(size=lambda digests: len(digests or ()))
+def find_manifest_digests(artifactory, repo_key, component_paths):
+    criteria = {"repo": repo_key, "name": "manifest.json", "$or": [{"path": path} for path in component_paths]}
+    response = artifactory.session.post(f"{artifactory.base_url}/artifactory/api/search/aql",
+                                        data=f'items.find({json.dumps(criteria)}).include("repo", "path", "name", '
+                                             f'"sha256")',
+                                        headers={"content-type": "text/plain"})
+    if response.status_code != 200:
+        logging.info(f"Manifest digests could not be searched: {response.text}")
+        return None
+    return {item["path"]: item.get("sha256") for item in response.json().get("results") or []}
+
+
+def group_by_digest(artifactory, repo_key, artifact_scans, chunk_size=100):
+    component_paths = sorted({artifact_scan.component_path for artifact_scan in artifact_scans})
+    digests = {}
+    for start in range(0, len(component_paths), chunk_size):
+        found = find_manifest_digests(artifactory, repo_key, component_paths[start:start + chunk_size])
+        if found is None:
+            digests = None
+            break
+        digests.update(found)
+
+    groups = {}
+    for artifact_scan in artifact_scans:
+        if digests is None:
+            digest = artifact_scan.get_manifest_digest()
+        else:
+            digest = digests.get(artifact_scan.component_path)
+        # Artifacts without a resolvable digest are scanned on their own
+        groups.setdefault(digest or artifact_scan.component_id, []).append(artifact_scan)
+    return groups
+
+
+def scan_digest(digest, artifact_scans, report_target_directory, report_cleaner=None, report_archive=None):
+    component_ids = [artifact_scan.component_id for artifact_scan in artifact_scans]
+    if len(component_ids) > 1:
+        logging.info(f"Artifacts {component_ids} share the manifest {digest} and are scanned once")
+
+    report = get_cached_report(digest)
+    if report:
+        logging.info(f"Reusing the report of manifest {digest} obtained earlier in this run")
+        remaining_component_ids = component_ids
+    else:
+        report = get_and_store_report(artifact_scans[0], report_target_directory, report_cleaner, report_archive)
+        cache_report(digest, report)
+        remaining_component_ids = component_ids[1:]
+
+    for component_id in remaining_component_ids:
+        store_report(report, component_id, report_target_directory, report_archive)
+    return report
+
+
+def contains_critical_vulnerabilities(report, component_id):
     logging.info(f"Report for artifact {component_id} successfully obtained. Starting analysis")
 
     ignored_vulnerabilities = get_ignored_vulnerabilities_from_file()
@@ -282,10 +553,9 @@ def analyse_report(report, component_id):
     analysis = ArtifactReportAnalysis(component_id, report, ignored_vulnerabilities)
     if analysis.contains_critical_vulnerabilities():
         logging.critical(f"Report for artifact {component_id} contains critical vulnerabilities")
-        exit(1)
-    else:
-        logging.info(f"Report for artifact {component_id} does not contains critical vulnerabilities")
-        exit(0)
+        return True
+    logging.info(f"Report for artifact {component_id} does not contains critical vulnerabilities")
+    return False
 
 
 def get_ignored_vulnerabilities_from_file():
@@ -299,19 +569,37 @@ def get_ignored_vulnerabilities_from_file():
     return ignored_vulnerabilities
 
 
-def main():
+def main(argv=None):
     init_logging()
 
-    args = parse_args()
-
-    artifactory = Artifactory(base_url=args.base_url, user=args.user, token=args.token)
-    artifact_scan = ArtifactScan(artifactory, args.component_id, args.repo_key)
+    args = parse_args(argv)
 
-    start_and_wait_for_scan(artifact_scan)
+    artifactory = connect(args.base_url, args.user, args.token)
+    status_table = ScanStatusTable(artifactory, args.repo_key, artifactory_id=args.artifactory_id)
+    artifact_scans = [ArtifactScan(artifactory, component_id, args.repo_key, status_table)
+                      for component_id in args.component_id]
 
-    scan_report = get_and_store_report(artifact_scan, args.report_target_directory)
-
-    analyse_report(scan_report, args.component_id)
+    # The gate exits from within, the cleaner is closed on the way out so that pending deletions still happen
+    report_cleaner = ReportCleaner()
+    try:
+        critical = []
+        groups = group_by_digest(artifactory, args.repo_key, artifact_scans)
+        # Manifests with a report obtained earlier in a batch are not scanned again
+        to_scan = [scans[0] for digest, scans in groups.items() if get_cached_report(digest) is None]
+        # One bulk request for the status of all artifacts instead of one request per artifact
+        status_table.register(artifact_scan.manifest_path for artifact_scan in to_scan)
+        status_table.refresh()
+        exit_if_already_scanned(to_scan)
+        start_and_wait_for_scans(to_scan, status_table)
+        for digest, scans in groups.items():
+            report = scan_digest(digest, scans, args.report_target_directory, report_cleaner, args.report_archive)
+            critical += [artifact_scan.component_id for artifact_scan in scans
+                         if contains_critical_vulnerabilities(report, artifact_scan.component_id)]
+        if critical:
+            logging.critical(f"Artifacts {critical} contain critical vulnerabilities")
+        exit(1 if critical else 0)
+    finally:
+        report_cleaner.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,119 @@
+import argparse
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from scan import REPORT_NAME_PREFIX, connect, init_logging
+from instrumentation import instrument
+
+
+def parse_report_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+
+
+# Instrumented per page, timing the generator below would only measure its creation
+@instrument(size=len)
+def get_reports_page(artifactory, page_num, page_size):
+    response = artifactory.session.post(f"{artifactory.xray_api_url}/reports?page_num={page_num}"
+                                        f"&num_of_rows={page_size}", json={})
+    if response.status_code != 200:
+        raise RuntimeError(f"Reports could not be listed: {response.text}")
+    return response.json().get("reports") or []
+
+
+def list_reports(artifactory, page_size=100):
+    page_num = 1
+    while True:
+        reports = get_reports_page(artifactory, page_num, page_size)
+        yield from reports
+        if len(reports) < page_size:
+            return
+        page_num += 1
+
+
+def legacy_name_pattern(repos):
+    # Reports created before REPORT_NAME_PREFIX are named after the component path only,
+    # e.g. docker://repo/app:1.0 -> repo-app-1-0, so they can only be told apart by the repo they start with
+    return "|".join(f"^{re.escape(repo.replace('/', '-').replace('.', '-'))}-[\\w-]+$" for repo in repos)
+
+
+def is_stale(report, name_pattern, cutoff, author=None):
+    if not name_pattern.search(report.get("name", "")):
+        return False
+    if author and report.get("author") != author:
+        return False
+    start_time = parse_report_time(report.get("start_time"))
+    if start_time is None:
+        # Without a start time the age is unknown, the report may still be in use
+        logging.debug(f"Skipping report {report.get('id')} ({report.get('name')}) without start time")
+        return False
+    return start_time < cutoff
+
+
+@instrument
+def delete_report(artifactory, report):
+    response = artifactory.session.delete(f"{artifactory.xray_api_url}/reports/{report['id']}")
+    if response.status_code not in (200, 404):
+        logging.error(f"Report {report['id']} ({report['name']}) could not be deleted: {response.text}")
+        return False
+    logging.debug(f"Report {report['id']} ({report['name']}) deleted")
+    return True
+
+
+def sweep_reports(artifactory, name_pattern, older_than, author=None, page_size=100, workers=8, dry_run=False):
+    cutoff = datetime.now(timezone.utc) - older_than
+    # Collect first, deleting while paging would shift the pages under us
+    stale_reports = [report for report in list_reports(artifactory, page_size)
+                     if is_stale(report, name_pattern, cutoff, author)]
+    logging.info(f"Found {len(stale_reports)} reports matching {name_pattern.pattern} started before {cutoff}")
+    if dry_run:
+        for report in stale_reports:
+            logging.info(f"Would delete report {report['id']} ({report['name']}) started at {report.get('start_time')}")
+        return len(stale_reports), 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda report: delete_report(artifactory, report), stale_reports))
+    deleted = results.count(True)
+    return deleted, len(results) - deleted
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Delete stale xray reports left behind by scan.py')
+    parser.add_argument("--user", help="The artifactory user name")
+    parser.add_argument("--token", help="The api token of the user")
+    parser.add_argument("--base-url", help="The url to artifactory")
+    parser.add_argument("--name-pattern", default=f"^{re.escape(REPORT_NAME_PREFIX)}",
+                        help="Regular expression the report name has to match. Defaults to the reports created "
+                             "by scan.py since it prefixes their names, see --legacy-repo for older reports")
+    parser.add_argument("--legacy-repo", action="append", default=[],
+                        help="Also match reports created by older versions of scan.py for components of this repo, "
+                             "named like repo-app-1-0 for docker://repo/app:1.0. Can be repeated. Combine with "
+                             "--author, these names cannot be told apart from other reports of the repo")
+    parser.add_argument("--older-than-hours", type=float, default=24,
+                        help="Only delete reports started more than this many hours ago")
+    parser.add_argument("--author", help="Only delete reports created by this user")
+    parser.add_argument("--page-size", type=int, default=100, help="Number of reports listed per request")
+    parser.add_argument("--workers", type=int, default=8, help="Number of concurrent deletions")
+    parser.add_argument("--dry-run", action="store_true", help="Only log the reports that would be deleted")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    init_logging()
+
+    args = parse_args(argv)
+
+    name_pattern = args.name_pattern
+    if args.legacy_repo:
+        name_pattern = f"(?:{name_pattern})|{legacy_name_pattern(args.legacy_repo)}"
+
+    artifactory = connect(args.base_url, args.user, args.token)
+    deleted, failed = sweep_reports(artifactory, re.compile(name_pattern), timedelta(hours=args.older_than_hours),
+                                    args.author, args.page_size, args.workers, args.dry_run)
+    logging.info(f"{deleted} reports {'would be ' if args.dry_run else ''}deleted, {failed} failed")
+    if failed:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
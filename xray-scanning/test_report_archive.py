@@ -0,0 +1,40 @@
+import unittest
+from report_archive import ReportArchive, component_name
+
+
+def create_report(*cves):
+    return {"total_rows": len(cves), "rows": [{"issue_id": f"XRAY-{cve}", "severity": "Critical",
+                                               "cves": [{"cve": cve}]} for cve in cves]}
+
+
+class ReportArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.archive = ReportArchive(":memory:")
+        self.archive.add("docker://repo/app:1.0", create_report("CVE-1"), "2021-01-01T00:00:00+00:00")
+        self.archive.add("docker://repo/app:1.1", create_report("CVE-1", "CVE-2"), "2021-01-02T00:00:00+00:00")
+        self.archive.add("docker://repo/other:1.0", create_report("CVE-2"), "2021-01-03T00:00:00+00:00")
+
+    def tearDown(self):
+        self.archive.close()
+
+    def test_component_name(self):
+        self.assertEqual(component_name("docker://repo/app:1.0"), "docker://repo/app")
+        self.assertEqual(component_name("docker://repo/app"), "docker://repo/app")
+
+    def test_first_seen(self):
+        first_seen = self.archive.first_seen("CVE-2")
+        self.assertEqual([(result["component_id"], result["first_seen"]) for result in first_seen],
+                         [("docker://repo/app:1.1", "2021-01-02T00:00:00+00:00"),
+                          ("docker://repo/other:1.0", "2021-01-03T00:00:00+00:00")])
+        self.assertEqual(len(self.archive.first_seen("CVE-2", "docker://repo/other")), 1)
+
+    def test_trend(self):
+        trend = self.archive.trend("docker://repo/app")
+        self.assertEqual([(result["component_id"], result["cves"]) for result in trend],
+                         [("docker://repo/app:1.0", 1), ("docker://repo/app:1.1", 2)])
+        self.assertEqual(len(self.archive.trend(cve="CVE-2")), 2)
+
+    def test_get(self):
+        self.assertEqual(self.archive.get(2), create_report("CVE-1", "CVE-2"))
+        self.assertIsNone(self.archive.get(42))
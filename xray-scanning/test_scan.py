@@ -1,5 +1,9 @@
+import json
+import re
 import unittest
-from scan import ArtifactScan
+from unittest import mock
+import scan
+from scan import ArtifactScan, group_by_digest, scan_digest
 
 
 class ScanOperationTest(unittest.TestCase):
@@ -8,3 +12,247 @@ class ScanOperationTest(unittest.TestCase):
         scan_operation = ArtifactScan(None, "docker://myrepo/path/component:5.0.50", None)
         component_path = scan_operation.convert_component_id_to_path()
         self.assertEqual(component_path, "myrepo/path/component/5.0.50")
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self._payload = payload
+
+    @property
+    def text(self):
+        return json.dumps(self._payload)
+
+    def json(self):
+        return self._payload
+
+
+class FakeArtifactory:
+    # Answers requests with routes of (method, url regex) -> function of the match and the request body
+
+    base_url = "https://artifactory"
+    ui_api_url = f"{base_url}/ui/api/v1/ui"
+    xray_api_url = f"{base_url}/xray/api/v1"
+
+    def __init__(self, routes):
+        self._routes = routes
+        self.requests = []
+        self.session = self
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        for (route_method, pattern), handler in self._routes.items():
+            match = re.search(pattern, url)
+            if route_method == method and match:
+                return FakeResponse(*handler(match, kwargs.get("json") or kwargs.get("data")))
+        return FakeResponse(404, {"errors": [{"message": f"No route for {method} {url}"}]})
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def count(self, method, url_part):
+        return len([url for request_method, url in self.requests if request_method == method and url_part in url])
+
+
+DIGESTS = {"myrepo/app/1.0": "sha-1", "myrepo/app/latest": "sha-1", "myrepo/other/1.0": "sha-2"}
+
+
+def search_digests(match, query):
+    criteria = json.loads(query[query.index("(") + 1:query.index(").include")])
+    return 200, {"results": [{"path": item["path"], "sha256": DIGESTS[item["path"]]}
+                             for item in criteria["$or"] if item["path"] in DIGESTS]}
+
+
+def storage_digest(match, body):
+    if match["path"] not in DIGESTS:
+        return 404, {"errors": [{"message": "Not found"}]}
+    return 200, {"checksums": {"sha256": DIGESTS[match["path"]]}}
+
+
+class GroupByDigestTest(unittest.TestCase):
+
+    COMPONENT_IDS = ["docker://myrepo/app:1.0", "docker://myrepo/app:latest", "docker://myrepo/other:1.0",
+                     "docker://myrepo/missing:1.0"]
+
+    def group(self, artifactory):
+        artifact_scans = [ArtifactScan(artifactory, component_id, "docker-local")
+                          for component_id in self.COMPONENT_IDS]
+        groups = group_by_digest(artifactory, "docker-local", artifact_scans, chunk_size=2)
+        return {digest: [artifact_scan.component_id for artifact_scan in scans] for digest, scans in groups.items()}
+
+    def test_tags_of_the_same_manifest_are_grouped(self):
+        artifactory = FakeArtifactory({("POST", r"/api/search/aql$"): search_digests})
+        self.assertEqual(self.group(artifactory), {"sha-1": self.COMPONENT_IDS[:2], "sha-2": self.COMPONENT_IDS[2:3],
+                                                   "docker://myrepo/missing:1.0": self.COMPONENT_IDS[3:]})
+        self.assertEqual(artifactory.count("POST", "/api/search/aql"), 2)
+        self.assertEqual(artifactory.count("GET", "/api/storage/"), 0)
+
+    @mock.patch("instrumentation._enabled", True)
+    def test_falls_back_to_storage_requests_if_search_is_not_permitted(self):
+        artifactory = FakeArtifactory({("POST", r"/api/search/aql$"): lambda match, query: (403, {}),
+                                       ("GET", r"/api/storage/docker-local/(?P<path>.+)/manifest.json$"):
+                                           storage_digest})
+        self.assertEqual(self.group(artifactory), {"sha-1": self.COMPONENT_IDS[:2], "sha-2": self.COMPONENT_IDS[2:3],
+                                                   "docker://myrepo/missing:1.0": self.COMPONENT_IDS[3:]})
+        self.assertEqual(artifactory.count("POST", "/api/search/aql"), 1)
+        self.assertEqual(artifactory.count("GET", "/api/storage/"), 4)
+
+
+@mock.patch("scan.store_report")
+@mock.patch("scan.get_and_store_report", return_value={"rows": []})
+class ScanDigestTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(scan._reports_by_digest, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.artifact_scans = [ArtifactScan(None, component_id, "docker-local")
+                               for component_id in ("docker://myrepo/app:1.0", "docker://myrepo/app:latest")]
+
+    def test_one_report_per_digest(self, get_and_store_report, store_report):
+        self.assertEqual(scan_digest("sha-1", self.artifact_scans, "reports"), {"rows": []})
+        get_and_store_report.assert_called_once_with(self.artifact_scans[0], "reports", None, None)
+        store_report.assert_called_once_with({"rows": []}, "docker://myrepo/app:latest", "reports", None)
+
+    def test_report_of_earlier_step_is_reused(self, get_and_store_report, store_report):
+        scan_digest("sha-1", self.artifact_scans[:1], "reports")
+        self.assertEqual(scan_digest("sha-1", self.artifact_scans[1:], "reports"), {"rows": []})
+        self.assertEqual(get_and_store_report.call_count, 1)
+        store_report.assert_called_once_with({"rows": []}, "docker://myrepo/app:latest", "reports", None)
+
+    @mock.patch("scan.REPORT_CACHE_SECONDS", -1)
+    def test_cached_reports_expire(self, get_and_store_report, store_report):
+        scan_digest("sha-1", self.artifact_scans[:1], "reports")
+        self.assertIsNone(scan.get_cached_report("sha-1"))
+        self.assertEqual(scan._reports_by_digest, {})
+        scan_digest("sha-1", self.artifact_scans[1:], "reports")
+        self.assertEqual(get_and_store_report.call_count, 2)
+
+
+class ExitIfAlreadyScannedTest(unittest.TestCase):
+
+    def test_all_artifacts_are_checked_before_exiting(self):
+        artifact_scans = [mock.Mock(component_id=f"docker://myrepo/app:{tag}", **{"is_scanned.return_value": scanned})
+                          for tag, scanned in (("1.0", False), ("2.0", True), ("3.0", False))]
+        with self.assertRaises(SystemExit) as context:
+            scan.exit_if_already_scanned(artifact_scans)
+        self.assertEqual(context.exception.code, 1)
+        self.assertEqual([artifact_scan.is_scanned.call_count for artifact_scan in artifact_scans], [1, 1, 1])
+
+    def test_nothing_scanned(self):
+        scan.exit_if_already_scanned([mock.Mock(**{"is_scanned.return_value": False})])
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeXray:
+    # Summary and per artifact status of artifacts that become indexed after the given number of summary requests
+
+    def __init__(self, indexed_after=None):
+        self.indexed_after = indexed_after or {}
+        self.summaries = 0
+
+    def is_indexed(self, path):
+        return path in self.indexed_after and self.summaries > self.indexed_after[path]
+
+    def summary(self, match, body):
+        self.summaries += 1
+        paths = [xray_path.split("/", 2)[-1] for xray_path in body["paths"]]
+        return 200, {"artifacts": [{"general": {"path": f"default/docker-local/{path}"}}
+                                   for path in paths if self.is_indexed(path)],
+                     "errors": [{"error": "Artifact doesn't exist or not indexed/cached in Xray",
+                                 "identifier": f"default/docker-local/{path}"}
+                                for path in paths if not self.is_indexed(path)]}
+
+    def artifact_status(self, match, body):
+        return 200, {"xrayIndexStatus": "Indexed" if self.is_indexed(f"{match['path']}") else "Not indexed"}
+
+    def artifactory(self):
+        return FakeArtifactory({("POST", r"/summary/artifact$"): self.summary,
+                                ("GET", r"/artifactxray\?path=(?P<path>[^&]+)"): self.artifact_status,
+                                ("POST", r"/scanArtifact$"): lambda match, body: (200, {})})
+
+
+@mock.patch("scan.time", new_callable=Clock)
+class ScanStatusTableTest(unittest.TestCase):
+
+    COMPONENT_IDS = [f"docker://myrepo/app:{index}" for index in range(3)]
+
+    def artifact_scans(self, artifactory, status_table):
+        return [ArtifactScan(artifactory, component_id, "docker-local", status_table)
+                for component_id in self.COMPONENT_IDS]
+
+    def test_summary_errors_are_confirmed_once_per_artifact(self, clock):
+        xray = FakeXray()
+        artifactory = xray.artifactory()
+        status_table = scan.ScanStatusTable(artifactory, "docker-local")
+        artifact_scans = self.artifact_scans(artifactory, status_table)
+        status_table.register(artifact_scan.manifest_path for artifact_scan in artifact_scans)
+        status_table.refresh()
+        self.assertEqual([artifact_scan.is_scanned() for artifact_scan in artifact_scans], [False] * 3)
+        self.assertEqual((artifactory.count("POST", "/summary/"), artifactory.count("GET", "/artifactxray")), (1, 3))
+
+        clock.sleep(3)
+        self.assertEqual([artifact_scan.is_scanned() for artifact_scan in artifact_scans], [False] * 3)
+        self.assertEqual((artifactory.count("POST", "/summary/"), artifactory.count("GET", "/artifactxray")), (4, 3))
+
+    def test_only_read_paths_are_refreshed(self, clock):
+        xray = FakeXray()
+        artifactory = xray.artifactory()
+        status_table = scan.ScanStatusTable(artifactory, "docker-local")
+        artifact_scans = self.artifact_scans(artifactory, status_table)
+        status_table.register(artifact_scan.manifest_path for artifact_scan in artifact_scans)
+        self.assertIsNone(status_table.is_indexed(artifact_scans[0].manifest_path))
+        self.assertEqual(artifactory.requests[0][0], "POST")
+        self.assertEqual(xray.summaries, 1)
+        self.assertIsNone(status_table.is_indexed(artifact_scans[0].manifest_path))
+        self.assertEqual(xray.summaries, 1)
+
+    def test_unsupported_summary_falls_back_per_artifact(self, clock):
+        artifactory = FakeArtifactory({("GET", r"/artifactxray"): lambda match, body: (200, {
+            "xrayIndexStatus": "Indexed"})})
+        status_table = scan.ScanStatusTable(artifactory, "docker-local")
+        artifact_scan = self.artifact_scans(artifactory, status_table)[0]
+        self.assertTrue(artifact_scan.is_scanned())
+        self.assertTrue(artifact_scan.is_scanned())
+        self.assertEqual((artifactory.count("POST", "/summary/"), artifactory.count("GET", "/artifactxray")), (1, 2))
+
+    def test_pending_scans_are_polled_together(self, clock):
+        xray = FakeXray({"myrepo/app/0/manifest.json": 1, "myrepo/app/1/manifest.json": 1,
+                         "myrepo/app/2/manifest.json": 2})
+        artifactory = xray.artifactory()
+        status_table = scan.ScanStatusTable(artifactory, "docker-local")
+        artifact_scans = self.artifact_scans(artifactory, status_table)
+        status_table.register(artifact_scan.manifest_path for artifact_scan in artifact_scans)
+        status_table.refresh()
+        scan.exit_if_already_scanned(artifact_scans)
+        requests = len(artifactory.requests)
+
+        scan.start_and_wait_for_scans(artifact_scans, status_table)
+        self.assertEqual(artifactory.count("POST", "/scanArtifact"), 3)
+        # One poll of all pending artifacts and one of the remaining one, without per artifact requests
+        self.assertEqual(len(artifactory.requests) - requests, 3 + 2)
+        self.assertEqual(artifactory.count("GET", "/artifactxray"), 3)
+
+    def test_scans_not_completed_in_time(self, clock):
+        xray = FakeXray({"myrepo/app/0/manifest.json": 1})
+        artifactory = xray.artifactory()
+        status_table = scan.ScanStatusTable(artifactory, "docker-local")
+        artifact_scans = self.artifact_scans(artifactory, status_table)
+        scan.exit_if_already_scanned(artifact_scans)
+        self.assertEqual(scan.wait_for_scans(artifact_scans, status_table, attempts=3),
+                         self.COMPONENT_IDS[1:])
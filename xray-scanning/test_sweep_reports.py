@@ -0,0 +1,25 @@
+import re
+import unittest
+from datetime import datetime, timedelta, timezone
+from sweep_reports import is_stale, legacy_name_pattern
+
+
+class SweepReportsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cutoff = datetime.now(timezone.utc) - timedelta(hours=1)
+        self.old = (self.cutoff - timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def test_report_without_start_time_is_not_stale(self):
+        name_pattern = re.compile("^ci-scan-")
+        self.assertTrue(is_stale({"name": "ci-scan-app", "start_time": self.old}, name_pattern, self.cutoff))
+        self.assertFalse(is_stale({"name": "ci-scan-app"}, name_pattern, self.cutoff))
+
+    def test_legacy_name_pattern(self):
+        name_pattern = re.compile(legacy_name_pattern(["myrepo"]))
+        self.assertTrue(is_stale({"name": "myrepo-path-component-5-0-50", "start_time": self.old}, name_pattern,
+                                 self.cutoff))
+        self.assertFalse(is_stale({"name": "myrepo2-component-5-0-50", "start_time": self.old}, name_pattern,
+                                  self.cutoff))
+        self.assertFalse(is_stale({"name": "myrepo-component 5.0", "start_time": self.old}, name_pattern,
+                                  self.cutoff))